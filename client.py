@@ -1,23 +1,26 @@
 import click
-from colorama import Fore
-from colorama import init as colorama_init
-from art import text2art
-
-from irc import Client, ServerConnection
-
-colorama_init(autoreset=True)
 
 
 @click.command()
 @click.argument("nickname", type=str, nargs=1)
 @click.argument("server_name", type=str, nargs=1)
-def run_client(nickname: str, server_name: str):
+@click.option("--persistent", is_flag=True, default=False,
+              help="Keep one connection open to receive the server's messages as they arrive.")
+@click.option("--in-memory", is_flag=True, default=False,
+              help="Do not store the client state on disk.")
+@click.option("--no-banner", is_flag=True, default=False,
+              help="Do not clear the terminal to print the banner.")
+def run_client(nickname: str, server_name: str, persistent: bool, in_memory: bool, no_banner: bool):
+    # Imported once the command line is parsed, so that `--help` is fast
+    from irc import Client, ServerConnection
+    from irc._utils import print_banner
+
     click.echo("Launching client...")
-    client = Client(nickname)
+    client = Client(nickname, persistent=persistent, in_memory=in_memory)
     client.connection = ServerConnection.from_name(server_name)
     client.run()
-    click.clear()
-    click.echo(f"{Fore.LIGHTBLUE_EX}{text2art('IRC client', font='random')}")
+    if not no_banner:
+        print_banner("IRC client")
     click.echo(f"Hello {nickname}!")
     while True:
         try:
@@ -28,6 +31,7 @@ def run_client(nickname: str, server_name: str):
         if command in ["exit", "quit", "q"]:
             click.echo("Exiting!")
             break
+    client.close()
 
 
 if __name__ == "__main__":
@@ -1,2 +1,24 @@
-from ._client import Client, ServerConnection
-from ._server import OwnServer, Server
+"""
+The objects of the package are imported when first accessed,
+so that importing it (e.g. to parse the command line) is fast.
+"""
+
+from importlib import import_module
+
+# Public name -> module defining it
+_exports = {
+    "Client": "._client",
+    "ServerConnection": "._client",
+    "OwnServer": "._server",
+    "Server": "._server",
+}
+
+__all__ = list(_exports)
+
+
+def __getattr__(name: str):
+    if name not in _exports:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(_exports[name], __name__), name)
+    globals()[name] = value
+    return value
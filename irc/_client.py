@@ -4,21 +4,30 @@ Client-specific code
 from __future__ import annotations
 
 import inspect
+import select
 import socket
 import time
 import queue
 
 from json import JSONDecoder
+from typing import TYPE_CHECKING
 
-from .objects import Command, ClientCommand, ClientChannel
+from . import objects
 from .threads import BaseThread
 from ._handler import CommandHandler
 from .design import Singleton
+from .database import Database, get_location
 from ._utils import Printer
-from .config import network_buffer_size
+from . import tracing
+from .config import network_buffer_size, frame_separator
+
+if TYPE_CHECKING:
+    from .objects import ClientCommand, Command
 
 
 sender_queue: queue.Queue[str] = queue.Queue()
+# Frames waiting to be written on the persistent connection
+outbox_queue: queue.Queue[bytes] = queue.Queue()
 
 
 printer = Printer(verbose=4)
@@ -37,6 +46,64 @@ class SenderThread(BaseThread):
             handler(command)
 
 
+class ReceiverThread(BaseThread):
+    """
+    Reads the persistent connection to the server, and forwards
+    every command pushed by it to the handler.
+    """
+
+    def run(self):
+        client = Client()
+        connection = client.socket
+        buffer = bytes()
+        while self.running:
+            try:
+                # The socket is blocking, for the writes of `OutboxThread`:
+                # we wait for something to read with a timeout instead,
+                # so that we stop once the client is closed.
+                readable, _, _ = select.select([connection], [], [], 1)
+                if not readable:
+                    continue
+                part = connection.recv(network_buffer_size)
+            except (OSError, ValueError):
+                part = bytes()
+            if not part:
+                printer.error(f"Connection to {client.connection!r} lost.")
+                break
+            *frames, buffer = (buffer + part).split(frame_separator)
+            for frame in frames:
+                if frame:
+                    sender_queue.put(frame.decode())
+
+
+class OutboxThread(BaseThread):
+    """
+    Writes the commands queued by the handler on the persistent connection.
+    Every frame available when it wakes up is sent in a single write,
+    without waiting for any response.
+    """
+
+    def run(self):
+        client = Client()
+        while self.running:
+            try:
+                frames = [outbox_queue.get(timeout=1)]
+            except queue.Empty:
+                continue
+            while True:
+                try:
+                    frames.append(outbox_queue.get(block=False))
+                except queue.Empty:
+                    break
+            try:
+                client.socket.sendall(b"".join(frames))
+            except OSError:
+                printer.error(
+                    f"Could not send {len(frames)} command(s) "
+                    f"to {client.connection!r}."
+                )
+
+
 class ClientHandler(CommandHandler):
     """
     Class containing the code used to handle the commands
@@ -49,21 +116,28 @@ class ClientHandler(CommandHandler):
         `command parameters...`, and returns a client command object.
         """
         if command.startswith("command:"):
-            nickname, recipient, command, *parameters, timestamp = command.split(':')
+            _, nickname, recipient, command, *parameters, timestamp = command.split(':')
             # In case there was some colon in the parameters section,
             # let's construct it back
             parameters = ':'.join(parameters)
-            return Command(
+            timestamp, trace_id, hops = tracing.parse_trace(timestamp)
+            if trace_id:
+                hops.append(tracing.get_hop(self.client.name, "receive"))
+                tracing.write(trace_id, hops)
+            return objects.Command(
                 author=nickname,
                 recipient=recipient,
                 identifier=command,
                 parameters=JSONDecoder().decode(parameters),
+                timestamp=timestamp,
+                trace_id=trace_id,
+                hops=hops,
             )
         # Remove the prefix
         if command.startswith("/"):
             command = command[1:]
         command_parts = command.split()
-        return ClientCommand(
+        return objects.ClientCommand(
             author=self.client.name,
             identifier=command_parts.pop(0),
             parameters=command_parts,
@@ -75,14 +149,14 @@ class ClientHandler(CommandHandler):
 
     def away(self, command: ClientCommand):
         if command.parameters:
-            self.client.send_command(Command(
+            self.client.send_command(objects.Command(
                 author=command.author,
                 recipient="*",
                 identifier=command.identifier,
                 parameters={"message": " ".join(command.parameters)},
             ))
         else:
-            self.client.send_command(Command(
+            self.client.send_command(objects.Command(
                 author=command.author,
                 recipient="*",
                 identifier=command.identifier,
@@ -105,14 +179,14 @@ class ClientHandler(CommandHandler):
         if len(command.parameters) != 2:
             printer.error("Invalid number of parameters.")
             return
-        chan = ClientChannel.from_name(command.parameters[1])
+        chan = objects.ClientChannel.from_name(command.parameters[1])
         if not chan:
             # This is not a channel, but a user
             printer.error(
                 f"{command.parameters[1]!r} is not a channel we're part of"
             )
             return
-        self.client.send_command(Command(
+        self.client.send_command(objects.Command(
             author=command.author,
             recipient=command.parameters[0],
             identifier=command.identifier,
@@ -123,17 +197,28 @@ class ClientHandler(CommandHandler):
         ))
 
     def join(self, command: ClientCommand):
-        if len(command.parameters) == 1:
-            channel = command.parameters[0]
+        # Options asking for the history of the channel:
+        # `history=<count>` and / or `since=<timestamp>`
+        options = {}
+        parameters = []
+        for parameter in command.parameters:
+            name, _, value = parameter.partition("=")
+            if name in ("history", "since") and value.isdigit():
+                options[name] = value
+            else:
+                parameters.append(parameter)
+
+        if len(parameters) == 1:
+            channel = parameters[0]
             key = ""
-        elif len(command.parameters) == 2:
-            channel = command.parameters[0]
-            key = command.parameters[1]
+        elif len(parameters) == 2:
+            channel = parameters[0]
+            key = parameters[1]
         else:
             printer.error("Invalid number of parameters.")
             return
 
-        self.client.send_command(Command(
+        self.client.send_command(objects.Command(
             author=command.author,
             recipient="*",
             identifier=command.identifier,
@@ -141,14 +226,27 @@ class ClientHandler(CommandHandler):
                 "channel": channel,
                 "key": key,
                 "host": "",
+                **options,
             }
         ))
 
+    def history(self, command: ClientCommand | Command):
+        """
+        Messages of a channel we joined, sent before we did.
+        """
+        if isinstance(command, objects.ClientCommand):
+            printer.error("History is asked for when joining: "
+                          "/join <channel> [key] history=<count> since=<timestamp>")
+            return
+        for timestamp, author, content in JSONDecoder().decode(command.parameters["messages"]):
+            sent_at = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp))
+            printer.info(f"[{sent_at}] {command.parameters['channel']} {author} | {content}")
+
     def list(self, command: ClientCommand):
         if command.parameters:
             printer.error("Invalid number of parameters.")
             return
-        self.client.send_command(Command(
+        self.client.send_command(objects.Command(
             author=command.author,
             recipient="*",
             identifier=command.identifier,
@@ -156,12 +254,12 @@ class ClientHandler(CommandHandler):
         ))
 
     def msg(self, command: ClientCommand | Command):
-        if isinstance(command, ClientCommand):
+        if isinstance(command, objects.ClientCommand):
             if len(command.parameters) <= 2:
                 printer.error("Invalid number of parameters.")
                 return
             parameters = command.parameters.copy()
-            self.client.send_command(Command(
+            self.client.send_command(objects.Command(
                 author=command.author,
                 recipient=parameters.pop(0),
                 identifier=command.identifier,
@@ -179,13 +277,42 @@ class ClientHandler(CommandHandler):
             printer.error("Invalid number of parameters.")
             return
 
-        self.client.send_command(Command(
+        self.client.send_command(objects.Command(
             author=command.author,
             recipient="*",
             identifier=command.identifier,
             parameters={"channel": channel},
         ))
 
+    def search(self, command: ClientCommand | Command):
+        if isinstance(command, objects.ClientCommand):
+            parameters = command.parameters.copy()
+            page = "0"
+            if parameters and parameters[-1].startswith("page="):
+                page = parameters.pop()[len("page="):]
+            if len(parameters) < 2 or not page.isdigit():
+                printer.error("Invalid number of parameters.")
+                return
+            self.client.send_command(objects.Command(
+                author=command.author,
+                recipient="*",
+                identifier=command.identifier,
+                parameters={
+                    "channel": parameters.pop(0),
+                    "terms": " ".join(parameters),
+                    "page": page,
+                },
+            ))
+            return
+        messages = JSONDecoder().decode(command.parameters["messages"])
+        printer.info(
+            f"{len(messages)} result(s) for {command.parameters['terms']!r} "
+            f"in {command.parameters['channel']} (page {command.parameters['page']})"
+        )
+        for timestamp, author, content in messages:
+            sent_at = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp))
+            printer.info(f"[{sent_at}] {author} | {content}")
+
     def _invalid(self, command: ClientCommand | Command):
         printer.error(f"Invalid command {command.identifier!r}.")
 
@@ -195,12 +322,22 @@ class Client(Singleton):
     """
     The unique client instance.
     Should not be instanced when running as a run_server.
+
+    When `persistent` is set, the client keeps a single connection open
+    to the server: commands are pipelined through an outbox, and the
+    server can push commands (messages, replies) at any time.
+    When `in_memory` is set, the client state is not written to disk.
     """
 
-    def __init__(self, name: str):
+    def __init__(self, name: str, persistent: bool = False, in_memory: bool = False):
         self.name = name
+        self.persistent = persistent
+        self.in_memory = in_memory
         self._server = None
+        self._socket = None
         self.send_thread = SenderThread()
+        self.receive_thread = ReceiverThread()
+        self.outbox_thread = OutboxThread()
 
     @property
     def connection(self):
@@ -215,9 +352,52 @@ class Client(Singleton):
     def connection(self, value: ServerConnection):
         self._server = value
 
+    @property
+    def socket(self) -> socket.socket:
+        if self._socket is None:
+            raise RuntimeError(
+                "The client has no persistent connection. "
+                "Create it with `persistent=True` and call `client.run()`. "
+            )
+        return self._socket
+
     def run(self):
+        self.database = Database(
+            None if self.in_memory
+            else get_location("client", self.connection.port, self.name)
+        )
+        self.database.set_default()
+        if self.persistent:
+            self.connect()
+            self.receive_thread.start()
+            self.outbox_thread.start()
         self.send_thread.start()
 
+    def connect(self):
+        """
+        Opens the persistent connection, and announces ourselves
+        so that the server knows where to push our commands.
+        """
+        self._socket = socket.create_connection(
+            (self.connection.address, self.connection.port), timeout=5,
+        )
+        # A write interrupted by a timeout would leave a frame half-sent
+        self._socket.settimeout(None)
+        self.send_command(objects.Command(
+            author=self.name,
+            recipient="",
+            identifier="hello",
+            parameters={},
+        ))
+
+    def close(self):
+        self.send_thread.stop()
+        self.receive_thread.stop()
+        self.outbox_thread.stop()
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
     def input(self, command: str):
         sender_queue.put(command)
 
@@ -225,9 +405,15 @@ class Client(Singleton):
         """
         Send a command to the server we're connected to.
         """
+        if not command.trace_id and (trace_id := tracing.sample()):
+            command.trace_id = trace_id
+            command.hops = [tracing.get_hop(self.name, "client_send")]
+        req = repr(command).encode() + frame_separator
+        if self.persistent:
+            outbox_queue.put(req)
+            return
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as client_sock:
             client_sock.settimeout(5)
-            req = repr(command).encode()
             try:
                 client_sock.connect((self.connection.address, self.connection.port))
                 total_sent = 0
@@ -238,6 +424,7 @@ class Client(Singleton):
                         printer.error("Socket connection broken")
                         return
                     total_sent += sent
+                client_sock.shutdown(socket.SHUT_WR)
             except (
                 socket.timeout,
                 ConnectionRefusedError,
@@ -253,7 +440,9 @@ class Client(Singleton):
             else:
                 # Wait for the response
                 response, _ = self._receive_all(client_sock)
-                sender_queue.put(response.decode())
+                for frame in response.split(frame_separator):
+                    if frame:
+                        sender_queue.put(frame.decode())
 
     def _receive_all(self, sock: socket.socket) -> tuple[bytes, tuple[str, int]]:
         """
@@ -48,7 +48,7 @@ class CommandHandler(ABC):
 
     @abstractmethod
     def join(self, command: _T):
-        """Join a channel by name. A key can optionally be passed."""
+        """Join a channel by name. A key can optionally be passed, as well as `history=<count>` and / or `since=<timestamp>` to get its last messages."""
         pass
 
     @abstractmethod
@@ -66,6 +66,11 @@ class CommandHandler(ABC):
         """Displays the list of users of the specified channel, otherwise, all channels and their users."""
         pass
 
+    @abstractmethod
+    def search(self, command: _T):
+        """Searches the messages of a channel containing some words, most recent first. A page can optionally be passed with `page=<number>`."""
+        pass
+
     @abstractmethod
     def _invalid(self, command: _T):
         """
@@ -0,0 +1,266 @@
+"""
+Persistent connections between servers.
+"""
+
+from __future__ import annotations
+
+import time
+import zlib
+import socket
+import struct
+import threading as th
+
+from json import JSONDecoder
+from typing import TYPE_CHECKING, Callable, Optional
+
+from .config import (
+    peer_flush_delay, peer_flush_bytes, frame_separator, network_buffer_size,
+    link_compression, link_compression_level, link_compression_min_size,
+    link_compression_dictionary,
+)
+from . import objects
+from .threads import BaseThread
+from ._utils import Printer, get_hash
+
+if TYPE_CHECKING:
+    from ._server import Server
+
+
+printer = Printer(verbose=4)
+
+# Once compression is negotiated, the stream is made of records:
+# a flag (whether the payload is compressed) and the payload length,
+# followed by the payload.
+_record_header = struct.Struct("!BI")
+_dictionary_id = get_hash(link_compression_dictionary)[:8]
+
+
+def get_link_command(author: str, recipient: str, compression: str) -> bytes:
+    """
+    Returns the command opening a link (offering `compression`),
+    or answering to it (accepting `compression`).
+    """
+    return repr(objects.Command(
+        author=author,
+        recipient=recipient,
+        identifier="link",
+        parameters={
+            "compression": compression,
+            "dictionary": _dictionary_id,
+        },
+    )).encode() + frame_separator
+
+
+def accept_compression(parameters: dict[str, str]) -> str:
+    """
+    Takes the parameters of a link offer, and returns the compression we
+    accept for it.
+    """
+    if (
+        link_compression == "zlib"
+        and parameters.get("compression") == "zlib"
+        and parameters.get("dictionary") == _dictionary_id
+    ):
+        return "zlib"
+    return "none"
+
+
+class FrameDecoder:
+
+    """
+    Decodes the records of a compressed link back into the raw stream.
+    """
+
+    def __init__(self):
+        self._buffer = bytes()
+        self._decompressor = zlib.decompressobj(zdict=link_compression_dictionary)
+        # CPU time spent decompressing, in seconds
+        self.decompression_time = 0.0
+
+    def feed(self, data: bytes) -> bytes:
+        self._buffer += data
+        decoded = []
+        while len(self._buffer) >= _record_header.size:
+            compressed, length = _record_header.unpack_from(self._buffer)
+            end = _record_header.size + length
+            if len(self._buffer) < end:
+                break
+            payload = self._buffer[_record_header.size:end]
+            self._buffer = self._buffer[end:]
+            if compressed:
+                start = time.thread_time()
+                payload = self._decompressor.decompress(payload)
+                self.decompression_time += time.thread_time() - start
+            decoded.append(payload)
+        return b"".join(decoded)
+
+
+class PeerLink(BaseThread):
+
+    """
+    Connection to another server, kept open.
+
+    Much like Nagle's algorithm, the commands queued for the peer are not
+    written right away: they are coalesced, and written in one go once
+    the oldest waited `delay` seconds, or once they reach `threshold`
+    bytes. Under load, this saves most of the writes (and packets).
+    The receiving end splits them on the frame separator.
+
+    When the connection is established, we offer the peer to compress it
+    (see `config.link_compression`). If it accepts, each write is
+    compressed with the same zlib context, so that the strings repeated
+    from one command to the next are only sent once.
+    """
+
+    def __init__(self,
+                 peer: Server,
+                 name: str,
+                 delay: float = peer_flush_delay,
+                 threshold: int = peer_flush_bytes,
+                 via: Optional[Server] = None,
+                 on_reconnect: Optional[Callable[[], None]] = None):
+        """
+        `name` is the name of the server owning the link.
+        If `via` is passed, we connect to it rather than to the peer
+        (e.g. a proxy, see `irc.netem`).
+        `on_reconnect` is called when the connection is established after
+        it was lost, or could not be made: what was sent in between is lost.
+        """
+        super().__init__()
+        self.peer = peer
+        self.name = name
+        self.via = via or peer
+        self.delay = delay
+        self.threshold = threshold
+        self.on_reconnect = on_reconnect
+        self._socket: Optional[socket.socket] = None
+        self._lost = False  # Whether the last write failed
+        self._compressor = None  # Set if the peer accepted compression
+        self._frames: list[bytes] = []
+        self._size = 0
+        self._first = 0.0  # When the oldest pending frame was queued
+        self._urgent = False  # Whether a pending frame must not wait
+        self._condition = th.Condition()
+        # Counters, to measure the effect of batching and compression
+        self.frames_sent = 0
+        self.writes = 0
+        self.bytes_in = 0  # Before compression
+        self.bytes_out = 0  # Written on the connection
+        self.compression_time = 0.0  # CPU time, in seconds
+
+    @property
+    def compression_ratio(self) -> float:
+        return self.bytes_in / self.bytes_out if self.bytes_out else 1.0
+
+    def put(self, content: bytes, urgent: bool = False) -> None:
+        """
+        Queues `content` to be sent. If `urgent`, it is sent right away,
+        along with the frames already queued.
+        """
+        with self._condition:
+            if not self._frames:
+                self._first = time.monotonic()
+                self._condition.notify()
+            self._frames.append(content)
+            self._size += len(content)
+            self._urgent = self._urgent or urgent
+            if self._size >= self.threshold or urgent:
+                self._condition.notify()
+
+    def stop(self):
+        super().stop()
+        # Wake the thread up, so that it flushes and stops right away
+        with self._condition:
+            self._condition.notify()
+
+    def run(self):
+        while self.running:
+            with self._condition:
+                if not self._frames:
+                    self._condition.wait(timeout=1)
+                    continue
+                while self._size < self.threshold and self.running and not self._urgent:
+                    remaining = self._first + self.delay - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                frames, self._frames, self._size = self._frames, [], 0
+                self._urgent = False
+            self._write(frames)
+        self.flush()
+        if self._socket is not None:
+            self._socket.close()
+
+    def flush(self) -> None:
+        """
+        Writes the pending frames right away.
+        """
+        with self._condition:
+            frames, self._frames, self._size = self._frames, [], 0
+        if frames:
+            self._write(frames)
+
+    def _connect(self) -> None:
+        """
+        Opens the connection, and negotiates its compression.
+        """
+        self._socket = socket.create_connection(
+            (self.via.address, self.via.port), timeout=5,
+        )
+        self._compressor = None
+        self._socket.sendall(get_link_command(self.name, self.peer.name, link_compression))
+        if link_compression == "none":
+            return
+        # Wait for the answer
+        answer = bytes()
+        while frame_separator not in answer:
+            part = self._socket.recv(network_buffer_size)
+            if not part:
+                raise ConnectionResetError
+            answer += part
+        _, _, _, _, *parameters, _ = answer.split(frame_separator)[0].decode().split(":")
+        parameters = JSONDecoder().decode(":".join(parameters))
+        if parameters.get("compression") == "zlib":
+            self._compressor = zlib.compressobj(
+                link_compression_level, zdict=link_compression_dictionary,
+            )
+
+    def _encode(self, content: bytes) -> bytes:
+        if self._compressor is None:
+            return content
+        if len(content) < link_compression_min_size:
+            return _record_header.pack(0, len(content)) + content
+        start = time.thread_time()
+        payload = (
+            self._compressor.compress(content)
+            + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        )
+        self.compression_time += time.thread_time() - start
+        return _record_header.pack(1, len(payload)) + payload
+
+    def _write(self, frames: list[bytes]) -> None:
+        content = b"".join(frames)
+        # If the connection was closed by the peer, we only notice it
+        # when writing: try again once on a new connection.
+        for _ in range(2):
+            try:
+                if self._socket is None:
+                    self._connect()
+                payload = self._encode(content)
+                self._socket.sendall(payload)
+            except (OSError, ValueError):
+                if self._socket is not None:
+                    self._socket.close()
+                    self._socket = None
+                continue
+            if self._lost:
+                self._lost = False
+                if self.on_reconnect is not None:
+                    self.on_reconnect()
+            self.writes += 1
+            self.frames_sent += len(frames)
+            self.bytes_in += len(content)
+            self.bytes_out += len(payload)
+            return
+        self._lost = True
+        printer.error(f"Could not send {len(frames)} command(s) to {self.peer!r}")
@@ -0,0 +1,179 @@
+from __future__ import annotations
+
+import pydantic
+
+from json import JSONDecoder, JSONEncoder
+from uuid import uuid4
+from typing import Optional, TypeVar
+from tinydb.queries import where
+
+from .database import Database
+from ._utils import get_time, get_hash
+from .tracing import format_trace
+
+
+_T = TypeVar("_T")
+
+
+class BaseObject(pydantic.BaseModel):
+
+    __table_name__: str
+    # Fields identifying an object, from which its `id` is derived
+    __key__: tuple[str, ...] = ("name", )
+
+    @property
+    def id(self) -> int:
+        """
+        Identifier of the object in its table, stable across processes.
+        """
+        key = ":".join(str(getattr(self, field)) for field in self.__key__)
+        return int(get_hash(key.encode())[:12], 16)
+
+    @classmethod
+    def all(cls: type[_T]) -> list[_T]:
+        """
+        Queries the database and gets every object of this type.
+        """
+        with Database.current() as db:
+            objects = []
+            for dbo in db.get_all(cls):
+                try:
+                    objects.append(cls(**dbo))
+                except pydantic.ValidationError:
+                    continue
+        return objects
+
+    def upsert(self) -> None:
+        with Database.current() as db:
+            db.upsert(self)
+
+    @classmethod
+    def from_name(cls: type[_T], name: str) -> Optional[_T]:
+        with Database.current() as db:
+            dbos = []
+            for doc in db.search(cls, where("name") == name):
+                try:
+                    dbos.append(cls(**doc))
+                except pydantic.ValidationError:
+                    continue
+            if len(dbos) == 1:
+                return dbos[0]
+            else:
+                return
+
+
+class User(BaseObject):
+
+    __table_name__ = "users"
+
+    name: str
+    # Server the user has a persistent connection to, see `OwnServer.clients`
+    host: str
+
+
+class Command(pydantic.BaseModel):
+
+    __table_name__ = "commands"
+
+    author: str  # Nickname
+    recipient: str  # Channel or nickname
+    identifier: str
+    parameters: dict[str, str]
+    timestamp: int = pydantic.Field(default_factory=get_time)
+    # Set if the command is traced, see `irc.tracing`
+    trace_id: str = ""
+    hops: list[str] = []
+
+    def __repr__(self) -> str:
+        return (
+            f"command"
+            f":{self.author}"
+            f":{self.recipient}"
+            f":{self.identifier}"
+            f":{JSONEncoder().encode(self.parameters)}"
+            f":{self.timestamp}"
+            f"{format_trace(self.trace_id, self.hops)}"
+        )
+
+    @classmethod
+    def from_repr(cls, command: str):
+        if not command.startswith("command:"):
+            raise pydantic.ValidationError
+        author, recipient, command, *parameters, timestamp = command.split(':')
+        # In case there was some colon in the parameters section,
+        # let's construct it back
+        parameters = ':'.join(parameters)
+        assert command == cls.identifier
+        return cls(
+            author=author,
+            recipient=recipient,
+            identifier=cls.identifier,
+            parameters=JSONDecoder().decode(parameters),
+        )
+
+
+class ClientCommand(pydantic.BaseModel):
+    """
+    Special state of a command, where parameters are not named,
+    but positional.
+    """
+
+    author: str
+    identifier: str
+    parameters: list[str]
+
+
+class Message(BaseObject):
+
+    __table_name__ = "messages"
+    # Timestamps are in seconds: the same message can be sent twice in one
+    __key__ = ("channel", "author", "timestamp", "content", "nonce")
+
+    author: str
+    channel: str
+    content: str
+    timestamp: int
+    nonce: str = pydantic.Field(default_factory=lambda: uuid4().hex[:12])
+
+    @classmethod
+    def all(cls, /, channel: Optional[str] = None) -> list[Message]:
+        dbos = super().all()
+        if channel:
+            return [
+                dbo for dbo in dbos
+                if dbo.channel == channel
+            ]
+        else:
+            return dbos
+
+
+class AwayRegister(BaseObject):
+    """
+    A simple register used to store whether a user is away.
+    """
+
+    __table_name__ = "away_reg"
+    __key__ = ("nickname", )
+
+    nickname: str
+    message: Optional[str]
+    # When the user went away, to forget it eventually (see `irc.retention`)
+    since: int = pydantic.Field(default_factory=get_time)
+
+
+class ClientChannel(BaseObject):
+
+    __table_name__ = "channel"
+
+    name: str
+    key: str
+
+
+class ServerChannel(BaseObject):
+
+    __table_name__ = "channel"
+
+    name: str
+    host: str  # Server hosting the channel
+    key: str
+    # Its members are only known to the host, see `OwnServer.membership`
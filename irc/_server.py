@@ -5,45 +5,208 @@ import socket
 import threading as th
 import queue
 
-from tinydb.queries import where
-from json import JSONDecoder
+from pathlib import Path
 
-from .config import network_buffer_size
+from uuid import uuid4
+from typing import TYPE_CHECKING, Iterator, Optional
+from contextlib import contextmanager
+from collections import deque
+from json import JSONDecoder, JSONEncoder
+
+from .config import (
+    network_buffer_size, frame_separator, channel_placement, sync_log_size,
+    retention_batch_size, handler_batch_size,
+)
 from ._handler import CommandHandler
 from .threads import BaseThread
-from .database import Database
-from .objects import AwayRegister, Command, ServerChannel, User
-from .design import Singleton
+from .database import Database, get_location
+from . import objects
+from .history import History
+from .retention import EvictionThread, Retention
+from .routing import HeartbeatThread, Router
+from .symbols import Membership, SymbolTable
+from .memory import MemoryDiagnostics
+from .placement import HashRing
+from . import snapshot, tracing
+from .capture import Capture
+from ._links import PeerLink, FrameDecoder, accept_compression, get_link_command
 from ._utils import Printer
 
-handle_queue: queue.Queue[bytes] = queue.Queue()
+if TYPE_CHECKING:
+    from .objects import BaseObject, Command, ServerChannel
 
 printer = Printer(verbose=4)
 
 
 class HandlerThread(BaseThread):
+    """
+    Handles the commands received by the server.
+
+    It takes every command waiting in the queue (up to `batch_size`)
+    and handles them in one pass. Under load, batches grow, which
+    amortizes the database accesses and the writes to the clients.
+    When idle, each command is handled as soon as it arrives.
+    """
+
+    def __init__(self, server: OwnServer, batch_size: int = handler_batch_size):
+        super().__init__()
+        self.server = server
+        self.batch_size = batch_size
+        # Number of batches and of commands handled, to measure batching
+        self.batches = 0
+        self.handled = 0
+
     def run(self):
-        handler = ServerHandler()
+        handler = ServerHandler(self.server)
+        self.server.database.bind()
+        handle_queue = self.server.handle_queue
         while self.running:
-            # We don't block because we want to be able to stop the thread
-            # with a condition.
+            # We don't block indefinitely because we want to be able
+            # to stop the thread with a condition.
             try:
-                raw_command = handle_queue.get(
-                    block=False
-                ).decode()
+                raw_commands = [handle_queue.get(timeout=1)]
             except queue.Empty:
-                time.sleep(2)
-                continue
-            except:
                 continue
-            handler(raw_command)
+            while len(raw_commands) < self.batch_size:
+                try:
+                    raw_commands.append(handle_queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with self.server.database.batch(), self.server.batch_pushes():
+                    for raw_command in self._decode(raw_commands):
+                        try:
+                            handler(raw_command)
+                        except Exception as error:
+                            # A bad command must not stop the handling of the others
+                            printer.error(f"Could not handle {raw_command!r}: {error!r}")
+            finally:
+                self.batches += 1
+                self.handled += len(raw_commands)
+                # Lets `OwnServer.close` wait for the queue to be drained
+                for _ in raw_commands:
+                    handle_queue.task_done()
+
+    @staticmethod
+    def _decode(raw_commands: list[bytes]) -> list[str]:
+        """
+        Decodes the commands of a batch at once,
+        leaving out the ones which are not valid UTF-8.
+        """
+        try:
+            return frame_separator.join(raw_commands).decode().split(frame_separator.decode())
+        except UnicodeDecodeError:
+            decoded = []
+            for raw_command in raw_commands:
+                try:
+                    decoded.append(raw_command.decode())
+                except UnicodeDecodeError:
+                    continue
+            return decoded
+
+
+class ConnectionThread(BaseThread):
+    """
+    Reads the commands sent over one connection, until it is closed.
+    One-shot senders close it after a single command, while persistent
+    clients keep it open so that we can push commands to them.
+    """
+
+    def __init__(self, server: OwnServer, connection: socket.socket, address: tuple[str, int]):
+        super().__init__()
+        self.server = server
+        self.connection = connection
+        self.address = address
+        self.nickname = None  # Set once the client said hello
+        self.peer_name = None  # Set if this is a link from another server
+        self.decoder: Optional[FrameDecoder] = None  # Set if the link is compressed
+        self._send_lock = th.Lock()
+
+    @property
+    def label(self) -> str:
+        return f"{self.address[0]}:{self.address[1]}"
+
+    def run(self):
+        buffer = bytes()
+        with self.connection:
+            while self.running:
+                try:
+                    part = self.connection.recv(network_buffer_size)
+                except OSError:
+                    break
+                if not part:
+                    break
+                if self.decoder is not None:
+                    part = self.decoder.feed(part)
+                *frames, buffer = (buffer + part).split(frame_separator)
+                for i, frame in enumerate(frames):
+                    if not frame:
+                        continue
+                    if self.decoder is None and self._is_link(frame):
+                        self._negotiate(frame)
+                        if self.decoder is not None:
+                            # What follows is encoded
+                            rest = frame_separator.join(frames[i + 1:] + [buffer])
+                            buffer = self.decoder.feed(rest)
+                            *more_frames, buffer = buffer.split(frame_separator)
+                            for more_frame in more_frames:
+                                if more_frame:
+                                    self.server.receive(more_frame, self)
+                            break
+                        continue
+                    self.server.receive(frame, self)
+            if buffer:
+                self.server.receive(buffer, self)
+        self.server.disconnect(self)
+
+    @staticmethod
+    def _is_link(frame: bytes) -> bool:
+        parts = frame.split(b":", 4)
+        return len(parts) == 5 and parts[3] == b"link"
+
+    def _negotiate(self, frame: bytes) -> None:
+        """
+        Answers to the offer of a server opening a link to us.
+        """
+        _, author, _, _, *parameters, _ = frame.decode().split(":")
+        self.peer_name = author
+        compression = accept_compression(JSONDecoder().decode(":".join(parameters)))
+        self.push(get_link_command(self.server.name, author, compression))
+        if compression == "zlib":
+            self.decoder = FrameDecoder()
+
+    def push(self, content: bytes) -> bool:
+        """
+        Sends `content` to the client at the other end of this connection.
+        Returns whether it succeeded.
+        """
+        if self.server.capture is not None:
+            self.server.capture.outbound(self, self.label, content)
+        with self._send_lock:
+            try:
+                self.connection.sendall(content)
+            except OSError:
+                printer.error(f"Could not push {content!r} to {self.nickname!r}")
+                return False
+        return True
 
 
 class ServerHandler(CommandHandler):
 
-    def __init__(self):
+    # Commands changing the server state,
+    # which are replicated to the sibling workers (see `irc.workers`).
+    replicated = {"away", "delta", "handoff", "hello", "join", "quit", "snapshot"}
+
+    def __init__(self, server: OwnServer):
         super().__init__()
-        self.server = OwnServer()
+        self.server = server
+
+    def __call__(self, to_handle: str):
+        super().__call__(to_handle)
+        if self.server.siblings and not self.server.replica:
+            parts = to_handle.split(":", 4)
+            if len(parts) == 5 and parts[3] in self.replicated:
+                self.server.replicate(to_handle)
 
     def _parse_command(self, command: str) -> Command:
         printer.error(f"Got this command: {command!r}")
@@ -52,37 +215,92 @@ class ServerHandler(CommandHandler):
         # let's construct it back
         parameters = ':'.join(parameters)
         printer.warning(parameters)
-        return Command(
+        timestamp, trace_id, hops = tracing.parse_trace(timestamp)
+        if trace_id:
+            hops.append(tracing.get_hop(self.server.name, "dispatch"))
+        # The commands sent while handling this one are part of its trace
+        self.server.trace = (trace_id, hops)
+        return objects.Command(
             author=nickname,
             recipient=recipient,
             identifier=command,
             parameters=JSONDecoder().decode(parameters),
+            timestamp=timestamp,
+            trace_id=trace_id,
+            hops=hops,
         )
 
     def away(self, command: Command):
-        with Database() as db:
-            if dbo := db.search(where('nickname') == command.author):
+        from tinydb.queries import where
+        with self.server.database as db:
+            if dbos := db.search(objects.AwayRegister, where('nickname') == command.author):
                 # User has used /away before, we remove the entry
-                away_reg = AwayRegister(**dbo)
+                away_reg = objects.AwayRegister(**dbos[0])
                 db.remove(away_reg)
+                self.server.record(away_reg, removed=True)
             else:
                 # User has no registry already saved, creating one (they're now away)
-                db.upsert(AwayRegister(
+                away_reg = objects.AwayRegister(
                     nickname=command.author,
-                    message=command.parameters["message"],
-                ))
+                    message=command.parameters.get("message"),
+                )
+                db.upsert(away_reg)
+                self.server.record(away_reg)
+
+    def hello(self, command: Command):
+        """
+        A client opened a persistent connection to us (see `OwnServer.receive`):
+        the other servers are told to send us what is addressed to them.
+        """
+        user = objects.User(name=command.author, host=self.server.name)
+        user.upsert()
+        self.server.hosts[user.name] = user.host
+        self.server.record(user)
+
+    def quit(self, command: Command):
+        """
+        The persistent connection of a client was closed
+        (see `OwnServer.disconnect`).
+        """
+        if command.author in self.server.clients:
+            # It connected again since
+            return
+        if self.server.hosts.get(command.author) != self.server.name:
+            return
+        user = objects.User(name=command.author, host=self.server.hosts.pop(command.author))
+        with self.server.database as db:
+            db.remove(user)
+        self.server.record(user, removed=True)
+
+    def deliver(self, command: Command):
+        """
+        A server, or a sibling worker, pushes a command to the clients
+        connected to us (see `OwnServer.send`). The ones we don't have
+        are connected to a sibling, which we forward it to.
+        """
+        if command.author != self.server.name and not self.server.get_peer(command.author):
+            return
+        content = command.parameters["command"].encode() + frame_separator
+        missing = []
+        for nickname in JSONDecoder().decode(command.parameters["nicknames"]):
+            if connection := self.server.clients.get(nickname):
+                self.server._push(connection, content)
+            else:
+                missing.append(nickname)
+        if missing and command.author != self.server.name:
+            self.server.deliver_to_siblings(command.parameters["command"], missing)
 
     def help(self, command: Command):
         """Not implemented by the run_server"""
         return
 
     def invite(self, command: Command):
-        chan = ServerChannel.from_name(command.parameters["channel"])
+        chan = objects.ServerChannel.from_name(command.parameters["channel"])
         if not chan:
             return
         if command.parameters["key"] != chan.key:
-            self.server.send(Command(
-                author=repr(self.server),
+            self.server.send(objects.Command(
+                author=self.server.name,
                 recipient=command.author,
                 identifier="message",
                 parameters={
@@ -93,46 +311,45 @@ class ServerHandler(CommandHandler):
             ))
 
     def join(self, command: Command):
-        chan = ServerChannel.from_name(command.parameters["channel"])
-        if not chan:
-            # We don't know this channel, so we'll create it.
-            if command.recipient == repr(self.server):
-                # This is the declaration of a channel that has been created
-                # on another host.
-                chan = ServerChannel(
+        chan = objects.ServerChannel.from_name(command.parameters["channel"])
+        if command.author == command.parameters["host"] and self.server.get_peer(command.author):
+            # This is the declaration of a channel by its host,
+            # which is another server.
+            chan = objects.ServerChannel(
+                name=command.parameters["channel"],
+                host=command.parameters["host"],
+                key=command.parameters["key"],
+            )
+            chan.upsert()
+            self.server.membership.discard(chan.name)
+        elif not chan:
+            # We don't know this channel, so it will be created on its host.
+            host = self.server.get_host(command.parameters["channel"])
+            if host == self.server.name:
+                chan = objects.ServerChannel(
                     name=command.parameters["channel"],
-                    host=command.author,
+                    host=self.server.name,
                     key=command.parameters["key"],
-                    members=[command.author],
                 )
                 chan.upsert()
+                self.server.membership.set(chan.name, [command.author])
+                self.server.record(chan)
+                self.server.declare(chan)
             else:
-                chan = ServerChannel(
-                    name=command.parameters["channel"],
-                    host=repr(self),
-                    key=command.parameters["key"],
-                    members=[command.author],
-                )
-                chan.upsert()
-                # Propagate the channel info to other servers
-                for peer in self.server.peers:
-                    self.server.send(Command(
-                        author=repr(self.server),
-                        recipient=repr(peer),
-                        identifier=command.identifier,
-                        parameters={
-                            "host": chan.host,
-                            "channel": chan.name,
-                            "key": chan.key,
-                        },
-                    ))
+                self.server.send(objects.Command(
+                    author=command.author,
+                    recipient=host,
+                    identifier=command.identifier,
+                    # Along with the history asked for, if any
+                    parameters={**command.parameters, "host": host},
+                ))
         else:
             # We know this channel
-            if chan.host == repr(self.server):
+            if chan.host == self.server.name:
                 # We are the host of this channel
                 if command.parameters["key"] != chan.key:
-                    self.server.send(Command(
-                        author=repr(self.server),
+                    self.server.send(objects.Command(
+                        author=self.server.name,
                         recipient=command.author,
                         identifier="msg",
                         parameters={
@@ -141,31 +358,128 @@ class ServerHandler(CommandHandler):
                                         f"invalid key {command.parameters['key']!r}."),
                         },
                     ))
+                else:
+                    self.server.membership.add(chan.name, command.author)
+                    self._replay(chan, command)
             else:
                 # We are not the channel host, just transmit the command.
-                self.server.send(Command(
+                self.server.send(objects.Command(
                     author=command.author,
                     recipient=chan.host,
                     identifier=command.identifier,
+                    # Along with the history asked for, if any
+                    parameters={**command.parameters, "host": chan.host},
+                ))
+
+    def handoff(self, command: Command):
+        """
+        A server gives us a channel it hosted, as the placement says
+        we are now its host.
+        """
+        if not self.server.get_peer(command.author):
+            return
+        chan = objects.ServerChannel(
+            name=command.parameters["channel"],
+            host=self.server.name,
+            key=command.parameters["key"],
+        )
+        chan.upsert()
+        self.server.membership.set(chan.name, JSONDecoder().decode(command.parameters["members"]))
+        self.server.record(chan)
+        self.server.declare(chan)
+
+    def rebalance(self, command: Command):
+        """
+        Moves the channels whose host changed since the servers of the
+        network changed (see `OwnServer.sync` and `OwnServer.on_peer_failed`).
+        """
+        if command.author != self.server.name or self.server.ring is None:
+            return
+        for chan in objects.ServerChannel.all():
+            host = self.server.get_host(chan.name)
+            if host == chan.host:
+                continue
+            if chan.host == self.server.name:
+                # Give the channel, with its members, to its new host
+                self.server.send(objects.Command(
+                    author=self.server.name,
+                    recipient=host,
+                    identifier="handoff",
                     parameters={
-                        "host": chan.host,
-                        "channel": command.parameters["channel"],
-                        "key": command.parameters["key"],
+                        "channel": chan.name,
+                        "key": chan.key,
+                        "members": JSONEncoder().encode([*self.server.membership.get_members(chan.name)]),
                     },
                 ))
+                chan.host = host
+                chan.upsert()
+                self.server.membership.discard(chan.name)
+                # We are not the authority on it anymore
+                self.server.record(chan, removed=True)
+            elif host == self.server.name and chan.host not in self.server.ring.nodes:
+                # Its host left the network, we take it over.
+                # Its members are lost with it.
+                chan.host = host
+                chan.upsert()
+                self.server.membership.set(chan.name, [])
+                self.server.record(chan)
+                self.server.declare(chan)
+
+    def evict(self, command: Command):
+        """
+        Removes a batch of what exceeds the retention limits
+        (see `irc.retention`), and schedules the next one if needed.
+        """
+        if command.author != self.server.name:
+            return
+        if self.server.retention.evict(retention_batch_size) >= retention_batch_size:
+            self.server.schedule("evict")
 
     def list(self, command: Command):
-        self.server.send(Command(
-            author=repr(self.server),
+        self.server.send(objects.Command(
+            author=self.server.name,
             recipient=command.author,
             identifier="msg",
             parameters={
-                "content": "\n".join([chan.name for chan in ServerChannel.all()]),
+                "content": "\n".join([chan.name for chan in objects.ServerChannel.all()]),
             },
         ))
 
+    def _replay(self, chan: ServerChannel, command: Command):
+        """
+        Sends the history of a channel to a user joining it,
+        if they asked for it (parameters `history` and / or `since`).
+        """
+        count, since = command.parameters.get("history", ""), command.parameters.get("since", "")
+        # Anything but a number is ignored
+        count = int(count) if count.isdigit() else None
+        since = int(since) if since.isdigit() else None
+        if count is None and since is None:
+            return
+        for chunk in self.server.history.replay(chan.name, count=count, since=since):
+            self.server.send(objects.Command(
+                author=self.server.name,
+                recipient=command.author,
+                identifier="history",
+                parameters={
+                    "channel": chan.name,
+                    "messages": JSONEncoder().encode([
+                        [message["timestamp"], message["author"], message["content"]]
+                        for message in chunk
+                    ]),
+                },
+            ))
+
     def msg(self, command: Command):
-        self.server.send(Command(
+        if self.server.membership.has_channel(command.recipient):
+            # A channel we host
+            self.server.history.add(objects.Message(
+                author=command.author,
+                channel=command.recipient,
+                content=command.parameters["content"],
+                timestamp=command.timestamp,
+            ))
+        self.server.send(objects.Command(
             author=command.author,
             recipient=command.recipient,
             identifier=command.identifier,
@@ -174,12 +488,12 @@ class ServerHandler(CommandHandler):
 
     def names(self, command: Command):
         if command.parameters["channel"]:
-            chan = ServerChannel.from_name(command.parameters["channel"])
+            chan = objects.ServerChannel.from_name(command.parameters["channel"])
             if not chan:
                 # This channel doesn't exist
                 # Transmit the response.
-                self.server.send(Command(
-                    author=repr(self.server),
+                self.server.send(objects.Command(
+                    author=self.server.name,
                     recipient=command.author,
                     identifier="msg",
                     parameters={
@@ -188,34 +502,188 @@ class ServerHandler(CommandHandler):
                     },
                 ))
                 return
-            if chan.host == repr(self.server):
-                self.server.send(Command(
-                    author=repr(self.server),
+            if chan.host == self.server.name:
+                self.server.send(objects.Command(
+                    author=self.server.name,
                     recipient=command.author,
                     identifier="msg",
                     parameters={
-                        "content": f"{chan.name!r}: {' - '.join(chan.members)}",
+                        "content": f"{chan.name!r}: "
+                                   f"{' - '.join(self.server.membership.get_members(chan.name))}",
                     },
                 ))
             else:
                 # We are not the host ; only they know the members
-                self.server.send(Command(
+                self.server.send(objects.Command(
                     author=command.author,
                     recipient=chan.host,
                     identifier=command.identifier,
                     parameters=command.parameters,
                 ))
         else:
-            for chan in ServerChannel.all():
-                self.server.send(Command(
-                    author=repr(self.server),
+            for chan in objects.ServerChannel.all():
+                # Only the members of the channels we host are known to us
+                self.server.send(objects.Command(
+                    author=self.server.name,
                     recipient=command.author,
                     identifier="msg",
                     parameters={
-                        "content": f"{chan.name!r}: {' - '.join(chan.members)}",
+                        "content": f"{chan.name!r}: "
+                                   f"{' - '.join(self.server.membership.get_members(chan.name))}",
                     },
                 ))
 
+    def search(self, command: Command):
+        chan = objects.ServerChannel.from_name(command.parameters["channel"])
+        if not chan:
+            self.server.send(objects.Command(
+                author=self.server.name,
+                recipient=command.author,
+                identifier="msg",
+                parameters={
+                    "content": f"The channel {command.parameters['channel']!r} "
+                               f"does not exist.",
+                },
+            ))
+        elif chan.host != self.server.name:
+            # Only the host has its history
+            self.server.send(objects.Command(
+                author=command.author,
+                recipient=chan.host,
+                identifier=command.identifier,
+                parameters=command.parameters,
+            ))
+        elif not self.server.membership.is_member(chan.name, command.author):
+            self.server.send(objects.Command(
+                author=self.server.name,
+                recipient=command.author,
+                identifier="msg",
+                parameters={
+                    "content": f"Cannot search channel {chan.name!r}: "
+                               f"you are not a member of it.",
+                },
+            ))
+        else:
+            page = command.parameters.get("page", "")
+            results = self.server.history.index.search(
+                chan.name,
+                command.parameters["terms"],
+                # Anything but a number is the first page
+                page=int(page) if page.isdigit() else 0,
+            )
+            self.server.send(objects.Command(
+                author=self.server.name,
+                recipient=command.author,
+                identifier="search",
+                parameters={
+                    **command.parameters,
+                    "messages": JSONEncoder().encode([
+                        [message["timestamp"], message["author"], message["content"]]
+                        for message in results
+                    ]),
+                },
+            ))
+
+    def sync(self, command: Command):
+        """
+        A server asks for our state: we send it the changes since the
+        version it knows, or a snapshot, and then stream the next ones.
+        """
+        self.server.subscribe(
+            Server.from_name(command.author),
+            command.parameters["epoch"],
+            int(command.parameters["version"]),
+        )
+
+    def snapshot(self, command: Command):
+        """
+        The whole state of a peer, see `sync`.
+        """
+        if not self.server.get_peer(command.author):
+            return
+        for table, state in JSONDecoder().decode(command.parameters["state"]):
+            self._apply(command.author, table, state, removed=False)
+        self.server.peer_versions[command.author] = (
+            command.parameters["epoch"],
+            int(command.parameters["version"]),
+        )
+
+    def delta(self, command: Command):
+        """
+        A change of the state of a peer, see `sync`.
+        """
+        peer = self.server.get_peer(command.author)
+        if not peer:
+            return
+        epoch, version = command.parameters["epoch"], int(command.parameters["version"])
+        known_epoch, known_version = self.server.peer_versions.get(command.author, ("", 0))
+        if epoch != known_epoch or version > known_version + 1:
+            # We missed some changes, ask for them again
+            self.server.request_sync(peer)
+            return
+        if version <= known_version:
+            return
+        self._apply(
+            command.author,
+            command.parameters["table"],
+            JSONDecoder().decode(command.parameters["state"]),
+            removed=bool(command.parameters["removed"]),
+        )
+        self.server.peer_versions[command.author] = (epoch, version)
+
+    def _apply(self, author: str, table: str, state: dict, removed: bool):
+        """
+        Applies a change of the state of a peer to ours.
+        A server only sends the state it is the authority on,
+        so we don't record these changes ourselves.
+        """
+        if table == objects.ServerChannel.__table_name__:
+            chan = objects.ServerChannel.from_name(state["name"])
+            if removed:
+                # The peer stopped hosting this channel
+                if not chan or chan.host != author:
+                    return
+                if state["host"] != author:
+                    # It was given to another server
+                    chan.host = state["host"]
+                    chan.upsert()
+                    return
+            elif state["host"] != author:
+                return
+            obj = objects.ServerChannel(**state)
+            self.server.membership.discard(obj.name)
+        elif table == objects.AwayRegister.__table_name__:
+            obj = objects.AwayRegister(**state)
+        elif table == objects.User.__table_name__:
+            if state["host"] != author:
+                return
+            obj = objects.User(**state)
+            if removed:
+                if self.server.hosts.get(obj.name) == author:
+                    del self.server.hosts[obj.name]
+            else:
+                self.server.hosts[obj.name] = author
+        else:
+            return
+        with self.server.database as db:
+            if removed:
+                db.remove(obj)
+            else:
+                db.upsert(obj)
+
+    def replicate(self, command: Command):
+        """
+        Applies a command already handled by a sibling worker.
+        Only the clients connected to us are sent something.
+        """
+        if command.author != self.server.name:
+            return
+        self.server.replica = True
+        try:
+            self(command.parameters["command"])
+        finally:
+            self.server.replica = False
+
     def _invalid(self, command: Command):
         pass
 
@@ -229,111 +697,643 @@ class Server:
     def __repr__(self):
         return f"{self.address}:{self.port}"
 
+    @property
+    def name(self) -> str:
+        """
+        Name identifying the server in the commands.
+        As servers all run on localhost, this is simply the port.
+        """
+        return str(self.port)
+
     @classmethod
-    def from_name(cls, name: str):
-        return cls("localhost", int(name))
+    def from_name(cls, name: str, **kwargs):
+        return cls("localhost", int(name), **kwargs)
 
 
-class OwnServer(Server, Singleton):
+class OwnServer(Server):
 
-    def __init__(self, *args, **kwargs):
+    """
+    The server run by this process.
+    All of its state is held by the instance, so several of them can live
+    in the same process (see `irc.cluster`).
+    """
+
+    def __init__(self, *args,
+                 in_memory: bool = False,
+                 worker: Optional[int] = None,
+                 placement: str = channel_placement,
+                 snapshot_location: Optional[Path] = None,
+                 capture: Optional[Path] = None,
+                 **kwargs):
+        """
+        If `in_memory` is set, the server state is not written to disk,
+        which is useful for ephemeral servers and benchmarks.
+        Otherwise, it is written to a snapshot at `snapshot_location`
+        (by default, next to the database) when the server stops,
+        and loaded back from it when it starts.
+        `worker` is the index of this server among the processes sharing
+        its port, if any (see `irc.workers`).
+        `placement` is the way channels hosts are chosen,
+        see `config.channel_placement`.
+        If `capture` is passed, the frames we receive and send are written
+        to this file (see `irc.capture`).
+        """
         super().__init__(*args, **kwargs)
+        self.worker = worker
+        self.ring = HashRing([self.name]) if placement == "consistent" else None
+        names = [self.port] + ([] if worker is None else [f"w{worker}"])
+        self.database = Database(None if in_memory else get_location("server", *names))
+        self.snapshot_location = snapshot_location or (
+            None if in_memory else get_location("server", *names, suffix=".snapshot")
+        )
+        # Read first: the database is restored from it rather than read
+        snapshot_state = self.load_snapshot()
+        # Raw commands received, waiting to be handled
+        self.handle_queue: queue.Queue[bytes] = queue.Queue()
+        # Members of the channels we host, by identifier (see `irc.symbols`)
+        self.symbols = SymbolTable()
+        self.membership = Membership(self.symbols)
+        # Messages of the channels we host, see `ServerHandler.msg`
+        self.history = History(self.database)
+        self.retention = Retention(self)
+        self._eviction_thread = EvictionThread(self)
+        # Liveness and latency of the links to our peers, see `irc.routing`
+        self.routing = Router(self)
+        self._heartbeat_thread = HeartbeatThread(self)
+        # Started from the console, see `irc.memory`
+        self.memory = MemoryDiagnostics(self, get_location("server", *names, suffix=".memory.jsonl"))
+
+        self._listen_thread = th.Thread(target=self.listen_for_commands, daemon=True)
+        self._handler_thread = HandlerThread(self)
+        self.peers: list[Server] = []  # see method `sync`
+        # Other workers sharing our port, reached on their internal address
+        self.siblings: list[Server] = []
+        self.internal: Optional[Server] = None
+        # Whether the command being handled was replicated by a sibling
+        self.replica = False
+        # Trace id and hops of the command being handled, if it is traced
+        self.trace: tuple[str, list[str]] = ("", [])
 
-        self._listen_thread = th.Thread(target=self.listen_for_commands)
-        self._handler_thread = HandlerThread()
-        self.peers = []  # see method `sync`
+        # State we share with the other servers: the channels we host,
+        # and presence. Each change gets a version, see `record`.
+        self.epoch = uuid4().hex[:8]  # Versions are only valid in an epoch
+        self.version = 0
+        self.state: dict[tuple[str, int], dict] = {}
+        self.deltas: deque[tuple[int, str, str, bool]] = deque(maxlen=sync_log_size)
+        # Servers streamed our changes, see `subscribe`
+        self.subscribers: dict[str, Server] = {}
+        # Epoch and version of the state of our peers we know of
+        self.peer_versions: dict[str, tuple[str, int]] = {}
+        for obj in (objects.ServerChannel, objects.AwayRegister, objects.User) if snapshot_state is None else ():
+            for dbo in self.database.get_all(obj):
+                instance = obj(**dbo)
+                if getattr(instance, "host", self.name) == self.name:
+                    self.state[(obj.__table_name__, instance.id)] = self._get_state(instance)
+        # Persistent client connections, by nickname
+        self.clients: dict[str, ConnectionThread] = {}
+        # Server each user with a persistent connection is connected to,
+        # by nickname: ourselves, or another server (see `send`)
+        self.hosts: dict[str, str] = {}
+        # Commands to push to them, while the handler handles a batch
+        self._pushes: Optional[dict[ConnectionThread, list[bytes]]] = None
+        # Persistent connections to other servers, by address
+        self.links: dict[tuple[str, int], PeerLink] = {}
+        # Servers through which we reach some peers, by name of the peer
+        # (e.g. proxies emulating the network, see `irc.netem`)
+        self.relays: dict[str, Server] = {}
+        self._links_lock = th.Lock()
         self._stop_event = th.Event()
+        self.capture = None if capture is None else Capture(capture)
+        if snapshot_state is not None:
+            self.restore(snapshot_state)
+        for document in self.database.get_all(objects.User):
+            self.hosts[document["name"]] = document["host"]
+        for document in self.database.get_all(objects.ServerChannel):
+            # Its members are lost if they were not in the snapshot
+            if document["host"] == self.name and not self.membership.has_channel(document["name"]):
+                self.membership.set(document["name"], [])
 
     def sync(self, *srv: tuple[Server]):
         """
         Takes one or more other servers, and registers them locally so that
         information can be replicated over those.
+        Servers we already know of (e.g. restored from the snapshot)
+        are skipped.
         """
+        srv = [peer for peer in srv if self.get_peer(peer.name) is None]
+        if not srv:
+            return
         self.peers.extend(srv)
+        for peer in srv:
+            self.request_sync(peer)
+        if self.ring is not None:
+            for peer in srv:
+                self.ring.add(peer.name)
+            # Let the handler move the channels whose host changed
+            self.schedule("rebalance")
 
-    def _send(self, content: bytes, peer: Server):
+    def schedule(self, identifier: str) -> None:
         """
-        Send something to someone specific.
+        Queues a command addressed to ourselves,
+        so that the handler runs it in between the others.
         """
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as client_sock:
-            client_sock.settimeout(5)
-            try:
-                client_sock.connect((peer.address, peer.port))
-                total_sent = 0
-                while total_sent < len(content):
-                    sent = client_sock.send(content[total_sent:])
-                    if sent == 0:
-                        printer.error("Socket connection broken")
-                    total_sent += sent
-            except (
-                    socket.timeout,
-                    ConnectionRefusedError,
-                    ConnectionResetError,
-                    OSError,
-            ):
-                printer.error(f"Could not send {content!r} to {peer!r}")
-            except Exception as e:
-                printer.error(f"Unhandled {type(e)} exception caught: {e!r}")
+        self.handle_queue.put(repr(objects.Command(
+            author=self.name,
+            recipient=self.name,
+            identifier=identifier,
+            parameters={},
+        )).encode())
+
+    @staticmethod
+    def _get_state(obj: BaseObject) -> dict:
+        return obj.dict()
+
+    def record(self, obj: BaseObject, removed: bool = False) -> None:
+        """
+        Records a change of the state we are the authority on (the channels
+        we host, the presence of the users connected to us), and streams it
+        to the servers which subscribed to it.
+        """
+        key = (obj.__table_name__, obj.id)
+        state = self._get_state(obj)
+        if removed:
+            if self.state.pop(key, None) is None:
+                return
+        elif self.state.get(key) == state:
+            return
+        else:
+            self.state[key] = state
+        self.version += 1
+        delta = (self.version, obj.__table_name__, JSONEncoder().encode(state), removed)
+        self.deltas.append(delta)
+        for subscriber in self.subscribers.values():
+            self._send_delta(delta, subscriber)
+
+    def _send_delta(self, delta: tuple[int, str, str, bool], server: Server) -> None:
+        version, table, state, removed = delta
+        self._send(repr(objects.Command(
+            author=self.name,
+            recipient=server.name,
+            identifier="delta",
+            parameters={
+                "epoch": self.epoch,
+                "version": str(version),
+                "table": table,
+                "state": state,
+                "removed": "1" if removed else "",
+            },
+        )).encode() + frame_separator, server)
+
+    def request_sync(self, peer: Server) -> None:
+        """
+        Asks a peer for its state, from the last version we know of.
+        """
+        epoch, version = self.peer_versions.get(peer.name, ("", 0))
+        self._send(repr(objects.Command(
+            author=self.name,
+            recipient=peer.name,
+            identifier="sync",
+            parameters={"epoch": epoch, "version": str(version)},
+        )).encode() + frame_separator, peer)
+
+    def resync(self, peer: Server) -> None:
+        """
+        Asks a peer for its state again, as what it sent us may have been
+        lost: the link to it was established again, or it came back
+        (see `on_peer_back`).
+        """
+        if self.get_peer(peer.name) is peer:
+            self.request_sync(peer)
+
+    def on_peer_failed(self, peer: Server) -> None:
+        """
+        A peer stopped answering our heartbeats (see `irc.routing`):
+        it left the network, and the channels it hosted are taken over.
+        We keep sending it heartbeats, to notice when it comes back.
+        """
+        printer.warning(f"{peer!r} is not answering anymore")
+        if self.ring is not None:
+            self.ring.remove(peer.name)
+            self.schedule("rebalance")
+
+    def on_peer_back(self, peer: Server) -> None:
+        """
+        A peer considered failed answers our heartbeats again.
+        """
+        printer.info(f"{peer!r} is back")
+        if self.ring is not None:
+            self.ring.add(peer.name)
+            self.schedule("rebalance")
+        self.resync(peer)
+
+    def subscribe(self, server: Server, epoch: str, version: int) -> None:
+        """
+        Sends our state to `server`: only the changes since `version` if
+        we still have them, otherwise a snapshot. The next changes
+        will be streamed to it.
+        """
+        self.subscribers[server.name] = server
+        if epoch == self.epoch and (
+            version == self.version
+            or (self.deltas and self.deltas[0][0] <= version + 1)
+        ):
+            for delta in self.deltas:
+                if delta[0] > version:
+                    self._send_delta(delta, server)
+            return
+        self._send(repr(objects.Command(
+            author=self.name,
+            recipient=server.name,
+            identifier="snapshot",
+            parameters={
+                "epoch": self.epoch,
+                "version": str(self.version),
+                "state": JSONEncoder().encode([
+                    (table, state) for (table, _), state in self.state.items()
+                ]),
+            },
+        )).encode() + frame_separator, server)
+
+    def get_host(self, channel: str) -> str:
+        """
+        Returns the name of the server which should host a new channel.
+        """
+        if self.ring is None:
+            return self.name
+        return self.ring.get(channel)
+
+    def declare(self, chan: ServerChannel) -> None:
+        """
+        Tells the other servers that we are the host of a channel.
+        """
+        for peer in self.peers:
+            self.send(objects.Command(
+                author=self.name,
+                recipient=peer.name,
+                identifier="join",
+                parameters={
+                    "host": chan.host,
+                    "channel": chan.name,
+                    "key": chan.key,
+                },
+            ))
+
+    def get_peer(self, name: str) -> Server | None:
+        for peer in self.peers:
+            if peer.name == name:
+                return peer
+
+    def _send(self, content: bytes, peer: Server, urgent: bool = False):
+        """
+        Send something to a specific server, through the link to it.
+        If `urgent`, it is not delayed to be batched with other commands.
+        """
+        key = (peer.address, peer.port)
+        link = self.links.get(key)
+        if link is None:
+            with self._links_lock:
+                link = self.links.get(key)
+                if link is None:
+                    link = PeerLink(
+                        peer, self.name,
+                        via=self.relays.get(peer.name),
+                        on_reconnect=lambda: self.resync(peer),
+                    )
+                    link.start()
+                    self.links[key] = link
+        if self.capture is not None:
+            self.capture.outbound(key, f"peer {peer.name}", content)
+        link.put(content, urgent)
 
     def send(self, command: Command):
         """
         Sends a command to someone.
         The contact information is inside the command.
         """
+        if not command.trace_id and self.trace[0]:
+            command.trace_id, command.hops = self.trace[0], self.trace[1].copy()
+        if command.trace_id:
+            command.hops.append(tracing.get_hop(self.name, "send"))
+            tracing.write(command.trace_id, command.hops)
+        cmd = repr(command).encode() + frame_separator
         if command.recipient == "*":
-            cmd = repr(command).encode()
-            for peer in self.peers:
-                self._send(cmd, peer)
+            if not self.replica:
+                for peer in self.peers:
+                    self._send(cmd, peer)
+            return
+
+        if connection := self.clients.get(command.recipient):
+            # This is a user connected to us, push it directly
+            self._push(connection, cmd)
             return
 
-        contact = User.from_name(command.recipient)
-        if not contact:
-            # This is not a user we know
-            pass
+        if not self.replica and (
+            peer := self.routing.get_next_hop(command.recipient) or self.get_peer(command.recipient)
+        ):
+            # Another server, reached through the best path we know
+            self._send(cmd, peer)
+            return
 
-        contact = ServerChannel.from_name(command.recipient)
-        if not contact:
-            # This is not a contact
-            # That was the last possibility, exit
+        if self.membership.has_channel(command.recipient):
+            # A channel we host, whose members we keep in memory
+            members = self.membership.get_members(command.recipient)
+        elif objects.ServerChannel.from_name(command.recipient):
+            # A channel hosted by another server, only it knows the members
             return
+        else:
+            # A user, connected to another server or to a sibling
+            members = [command.recipient]
 
         printer.info(f"Sending {command!r}")
+        # Members connected to other servers, by server,
+        # and the ones which might be connected to a sibling.
+        elsewhere: dict[str, list[str]] = {}
+        on_siblings = []
+        for member in members:
+            if member == command.author:
+                continue
+            if connection := self.clients.get(member):
+                self._push(connection, cmd)
+            elif (host := self.hosts.get(member, self.name)) != self.name:
+                elsewhere.setdefault(host, []).append(member)
+            else:
+                on_siblings.append(member)
+        if self.replica:
+            return
+        if on_siblings:
+            self.deliver_to_siblings(repr(command), on_siblings)
+        for host, nicknames in elsewhere.items():
+            self.send(self._get_delivery(host, repr(command), nicknames))
+
+    def _get_delivery(self, recipient: str, raw_command: str, nicknames: list[str]) -> Command:
+        """
+        Returns the command asking `recipient` to push `raw_command`
+        to these clients of theirs (see `ServerHandler.deliver`).
+        """
+        return objects.Command(
+            author=self.name,
+            recipient=recipient,
+            identifier="deliver",
+            parameters={
+                "command": raw_command,
+                "nicknames": JSONEncoder().encode(nicknames),
+            },
+        )
+
+    def deliver_to_siblings(self, raw_command: str, nicknames: list[str]) -> None:
+        """
+        Asks the sibling workers to push `raw_command` to these clients,
+        if they are connected to them. Only the command is sent: they
+        don't handle it again.
+        """
+        if not self.siblings:
+            return
+        cmd = repr(self._get_delivery(self.name, raw_command, nicknames)).encode() + frame_separator
+        for sibling in self.siblings:
+            self._send(cmd, sibling)
+
+    @contextmanager
+    def batch_pushes(self) -> Iterator[None]:
+        """
+        Within this context, the commands the handler pushes to a client
+        are merged, and sent in one write when exiting it.
+        """
+        self._pushes = {}
+        try:
+            yield
+        finally:
+            pushes, self._pushes = self._pushes, None
+            for connection, commands in pushes.items():
+                connection.push(b"".join(commands))
+
+    def _push(self, connection: ConnectionThread, content: bytes) -> None:
+        if self._pushes is not None and th.current_thread() is self._handler_thread:
+            self._pushes.setdefault(connection, []).append(content)
+        else:
+            connection.push(content)
+
+    def replicate(self, raw_command: str):
+        """
+        Forwards a command to the sibling workers, which apply it
+        as if they had received it, without propagating it any further.
+        """
+        if not self.siblings or self.replica:
+            return
+        cmd = repr(objects.Command(
+            author=self.name,
+            recipient=self.name,
+            identifier="replicate",
+            parameters={"command": raw_command},
+        )).encode() + frame_separator
+        for sibling in self.siblings:
+            self._send(cmd, sibling)
 
     def listen(self):
+        # The clients connected to us before we stopped are gone
+        for document in self.database.get_all(objects.User):
+            if document["host"] == self.name:
+                user = objects.User(**document)
+                self.database.remove(user)
+                self.hosts.pop(user.name, None)
+                self.record(user, removed=True)
         self._handler_thread.start()
+        self._eviction_thread.start()
+        self._heartbeat_thread.start()
         self._listen_thread.start()
+        if self.internal is not None:
+            th.Thread(
+                target=self.listen_for_commands,
+                args=(self.internal, ),
+                daemon=True,
+            ).start()
+        # Catch up with the peers restored from the snapshot
+        for peer in self.peers:
+            self.request_sync(peer)
 
-    def listen_for_commands(self) -> None:
+    def listen_for_commands(self, on: Optional[Server] = None) -> None:
         """
         Sets up a run_server and listens on a port.
         It requires a TCP connection to receive information.
+        By default, listens on our own address, otherwise on the one of `on`.
         """
+        on = on or self
         with socket.socket() as server_socket:
             server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            server_socket.bind((self.address, self.port))
+            if self.worker is not None:
+                # Share the port with the other workers
+                server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            server_socket.bind((on.address, on.port))
             server_socket.listen()
+            # We don't block indefinitely, so that we stop accepting
+            # connections once the server is closed.
+            server_socket.settimeout(1)
             while not self._stop_event.is_set():
-                connection, address = server_socket.accept()
-                raw_command, _ = self._receive_all(connection)
-                printer.info(f"Received raw command {raw_command.decode()}")
-                handle_queue.put(raw_command)
-                connection.close()
-
-    def _receive_all(self, sock: socket.socket) -> tuple[bytes, tuple[str, int]]:
-        """
-        Receives all parts of a network-sent message.
-        Takes a socket object and returns a tuple with
-        (1) the complete message as bytes
-        (2) a tuple with (1) the address and (2) distant port of the sender.
-        """
-        data = bytes()
-        while True:
-            part, addr = sock.recvfrom(network_buffer_size)
-            data += part
-            if len(part) < network_buffer_size:
-                # Either 0 or end of data
-                break
-        return data, addr
-
-    def close(self):
+                try:
+                    connection, address = server_socket.accept()
+                except socket.timeout:
+                    continue
+                connection.settimeout(None)
+                ConnectionThread(self, connection, address).start()
+
+    def receive(self, raw_command: bytes, connection: ConnectionThread) -> None:
+        """
+        Called by the connection threads for each command they read.
+        """
+        printer.info(f"Received raw command {raw_command.decode()}")
+        if self.capture is not None:
+            self.capture.inbound(connection, connection.label, raw_command)
+        parts = raw_command.split(b":", 4)
+        if len(parts) == 5 and parts[3] == b"hello":
+            # A client opening a persistent connection: register it,
+            # so that we can push it the commands addressed to it.
+            connection.nickname = parts[1].decode()
+            self.clients[connection.nickname] = connection
+            # For the handler to tell the other servers where they are
+            self.handle_queue.put(raw_command)
+            return
+        if len(parts) == 5 and parts[3] in (b"ping", b"pong"):
+            # Handled right away, so that the queue does not add to the latency
+            _, author, _, identifier, rest = raw_command.decode().split(":", 4)
+            parameters, _ = rest.rsplit(":", 1)
+            self.routing.receive(identifier, author, JSONDecoder().decode(parameters))
+            return
+        if (
+            len(parts) == 5
+            and parts[2].decode() != self.name
+            and (hop := self.routing.get_next_hop(parts[2].decode()))
+        ):
+            # Addressed to another server, which we are on the path to
+            if hop.name == connection.peer_name:
+                printer.error(f"Dropping {raw_command!r}, which would go back to {hop.name}")
+                return
+            self._send(raw_command + frame_separator, hop)
+            return
+        self.handle_queue.put(tracing.add_hop(raw_command, self.name, "enqueue"))
+
+    def disconnect(self, connection: ConnectionThread) -> None:
+        if self.capture is not None:
+            self.capture.closed(connection, connection.label)
+        if connection.nickname and self.clients.get(connection.nickname) is connection:
+            del self.clients[connection.nickname]
+            self.handle_queue.put(repr(objects.Command(
+                author=connection.nickname,
+                recipient=self.name,
+                identifier="quit",
+                parameters={},
+            )).encode())
+
+    def drain(self, timeout: float) -> bool:
+        """
+        Waits for the commands received to be handled,
+        for at most `timeout` seconds.
+        Returns whether they all were.
+        """
+        deadline = time.monotonic() + timeout
+        with self.handle_queue.all_tasks_done:
+            while self.handle_queue.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.handle_queue.all_tasks_done.wait(remaining)
+        return True
+
+    def save(self) -> None:
+        """
+        Writes the snapshot of our state: the channels, their members and
+        presence, the servers we know of, and the versions of their state
+        and of ours, so that we resume where we stopped.
+        """
+        if self.snapshot_location is None:
+            return
+        snapshot.save(self.snapshot_location, {
+            "database": self.database.dump(),
+            "membership": self.membership.dump(),
+            "peers": [(peer.address, peer.port) for peer in self.peers],
+            "subscribers": [
+                (subscriber.address, subscriber.port)
+                for subscriber in self.subscribers.values()
+            ],
+            "peer_versions": self.peer_versions,
+            "epoch": self.epoch,
+            "version": self.version,
+            "state": self.state,
+            "deltas": list(self.deltas),
+        })
+
+    def load_snapshot(self) -> Optional[dict]:
+        """
+        Reads the snapshot written by `save`, if any, and restores the
+        database from it.
+        If the database was not written since, the snapshot holds the
+        same content: it is used as is, and the database file is neither
+        read nor written. Otherwise (e.g. we crashed after starting again),
+        the file is read, and only the channels and presence are restored.
+        Returns the state to restore once the server is set up (see `restore`).
+        """
+        if self.snapshot_location is None:
+            return
+        state = snapshot.load(self.snapshot_location)
+        if state is None:
+            return
+        location = self.database.location
+        if location is None or not location.is_file() or (
+            location.stat().st_mtime_ns <= self.snapshot_location.stat().st_mtime_ns
+        ):
+            self.database.load(state["database"])
+        else:
+            for obj in (objects.ServerChannel, objects.AwayRegister):
+                documents = state["database"].get(obj.__table_name__, {})
+                self.database.insert_all(obj, {int(doc_id): document for doc_id, document in documents.items()})
+        return state
+
+    def restore(self, state: dict) -> None:
+        """
+        Restores our state from the snapshot read by `load_snapshot`.
+        """
+        for channel, members in state["membership"].items():
+            self.membership.set(channel, members)
+        self.peers = [Server(*address) for address in state["peers"]]
+        self.subscribers = {
+            subscriber.name: subscriber
+            for subscriber in (Server(*address) for address in state["subscribers"])
+        }
+        self.peer_versions = state["peer_versions"]
+        self.epoch, self.version = state["epoch"], state["version"]
+        self.state = state["state"]
+        self.deltas.extend(state["deltas"])
+        if self.ring is not None:
+            for peer in self.peers:
+                self.ring.add(peer.name)
+        printer.info(f"Restored {self.snapshot_location} at version {self.version}")
+
+    def close(self, timeout: float = 5):
+        """
+        Stops gracefully: we stop accepting connections, handle the
+        commands already received, flush the links to the other servers,
+        and write the snapshot of our state.
+        """
         self._stop_event.set()
+        self._eviction_thread.stop()
+        self._heartbeat_thread.stop()
+        if self._handler_thread.is_alive() and not self.drain(timeout):
+            printer.warning(f"{self.handle_queue.unfinished_tasks} commands left unhandled")
+        self._handler_thread.stop()
+        if self._handler_thread.is_alive():
+            self._handler_thread.join(timeout)
+        with self._links_lock:
+            links = list(self.links.values())
+        for link in links:
+            link.stop()
+        for link in links:
+            link.join(timeout)
+        for connection in list(self.clients.values()):
+            connection.stop()
+            try:
+                connection.connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self.save()
+        if self.capture is not None:
+            self.capture.close()
+        if self.memory.tracing:
+            self.memory.stop()
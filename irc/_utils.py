@@ -4,14 +4,12 @@ import time
 import click
 
 from hashlib import md5
-from colorama import Fore
+from functools import lru_cache
 from collections import defaultdict
 from typing import Callable, Iterable
 from abc import abstractmethod
 from typing import Protocol, runtime_checkable, TypeVar, Hashable
 
-from .design import Singleton
-
 
 _T = TypeVar("_T")
 
@@ -42,6 +40,13 @@ def get_time() -> int:
     return round(time.time(), None)
 
 
+def get_time_ns() -> int:
+    """
+    Returns the current time as nanoseconds since the epoch.
+    """
+    return time.time_ns()
+
+
 def get_hash(value: bytes) -> str:
     return md5(value).hexdigest()
 
@@ -64,7 +69,26 @@ def iter_to_dict(iterable: Iterable[_T], /, key: Callable) -> dict[Hashable, lis
     return dict(final)
 
 
-class Printer(Singleton):
+@lru_cache(maxsize=None)
+def _get_colors():
+    # Imported when first needed, as it is slow to import,
+    # and initialized then, so that each message resets the color.
+    from colorama import Fore, init as colorama_init
+    colorama_init(autoreset=True)
+    return Fore
+
+
+def print_banner(text: str) -> None:
+    """
+    Clears the terminal, and prints `text` in large letters.
+    """
+    from art import text2art
+
+    click.clear()
+    click.echo(f"{_get_colors().LIGHTBLUE_EX}{text2art(text, font='random')}")
+
+
+class Printer:
 
     def __init__(self, verbose: int = 3):
         self.verbose = verbose
@@ -75,12 +99,12 @@ class Printer(Singleton):
 
     def error(self, message: str):
         if self.verbose >= 2:
-            click.echo(f"{Fore.LIGHTRED_EX}{message}")
+            click.echo(f"{_get_colors().LIGHTRED_EX}{message}")
 
     def warning(self, message: str):
         if self.verbose >= 3:
-            click.echo(f"{Fore.LIGHTYELLOW_EX}{message}")
+            click.echo(f"{_get_colors().LIGHTYELLOW_EX}{message}")
 
     def debug(self, message: str):
         if self.verbose >= 4:
-            click.echo(f"{Fore.LIGHTBLUE_EX}{message}")
+            click.echo(f"{_get_colors().LIGHTBLUE_EX}{message}")
@@ -0,0 +1,95 @@
+"""
+Capture of the traffic of a server, to replay it later
+(see `python -m tools.replay`).
+
+A capture file starts with `magic`, followed by records made of
+a header (kind, time in nanoseconds, connection, payload length)
+and the payload. A connection is described (by its address, or the
+server at its other end) in a `CONNECTION` record the first time it is
+seen, and is then only referred to by its number.
+"""
+
+from __future__ import annotations
+
+import struct
+import threading as th
+
+from pathlib import Path
+from typing import BinaryIO, Hashable, Iterator
+
+from ._utils import get_time_ns
+
+
+magic = b"IRCCAP1\n"
+
+# Kinds of records
+CONNECTION = 0  # The payload is the description of the connection
+INBOUND = 1  # A frame received on the connection
+OUTBOUND = 2  # A frame sent on the connection
+CLOSED = 3  # The connection was closed
+
+_header = struct.Struct("!BQII")
+
+
+class Capture:
+
+    """
+    Writes the frames a server receives and sends to a capture file.
+    It is shared by the threads of the server.
+    """
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self._file: BinaryIO = path.open("wb")
+        self._file.write(magic)
+        self._connections: dict[Hashable, int] = {}
+        self._next = 0  # Number of the next connection
+        self._lock = th.Lock()
+
+    def _write(self, kind: int, connection: Hashable, description: str, payload: bytes) -> None:
+        time = get_time_ns()
+        with self._lock:
+            if self._file.closed:
+                return
+            number = self._connections.get(connection)
+            if number is None:
+                number = self._connections[connection] = self._next
+                self._next += 1
+                label = description.encode()
+                self._file.write(_header.pack(CONNECTION, time, number, len(label)) + label)
+            self._file.write(_header.pack(kind, time, number, len(payload)) + payload)
+            if kind == CLOSED:
+                # A later connection from the same address gets a new number
+                del self._connections[connection]
+
+    def inbound(self, connection: Hashable, description: str, frame: bytes) -> None:
+        self._write(INBOUND, connection, description, frame)
+
+    def outbound(self, connection: Hashable, description: str, frame: bytes) -> None:
+        self._write(OUTBOUND, connection, description, frame)
+
+    def closed(self, connection: Hashable, description: str) -> None:
+        self._write(CLOSED, connection, description, bytes())
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+def read(path: Path) -> Iterator[tuple[int, int, int, bytes]]:
+    """
+    Yields the records of a capture file, as (kind, time, connection, payload).
+    """
+    with path.open("rb") as file:
+        if file.read(len(magic)) != magic:
+            raise ValueError(f"{path} is not a capture file")
+        while header := file.read(_header.size):
+            if len(header) < _header.size:
+                # Truncated, e.g. the server was killed while writing it
+                return
+            kind, time, connection, length = _header.unpack(header)
+            payload = file.read(length)
+            if len(payload) < length:
+                return
+            yield kind, time, connection, payload
@@ -0,0 +1,125 @@
+"""
+Runs several servers in the same process, which makes it cheap to
+simulate a network of servers, e.g. for routing and propagation benchmarks.
+The links between them can go through proxies emulating a real network
+(see `irc.netem`).
+"""
+
+from __future__ import annotations
+
+import socket
+
+from typing import TYPE_CHECKING, Iterator, Optional
+
+from .config import frame_separator
+from .netem import LinkProfile, Proxy
+from ._server import OwnServer, Server
+
+if TYPE_CHECKING:
+    from .objects import Command
+
+
+topologies = ("mesh", "line", "ring", "star")
+
+
+def get_links(size: int, topology: str = "mesh") -> list[tuple[int, int]]:
+    """
+    Returns the (undirected) links between `size` servers, as pairs of
+    indices, for the specified topology.
+
+    Examples
+    --------
+    >>> get_links(3, "mesh")
+    [(0, 1), (0, 2), (1, 2)]
+    >>> get_links(4, "line")
+    [(0, 1), (1, 2), (2, 3)]
+    >>> get_links(4, "ring")
+    [(0, 1), (1, 2), (2, 3), (3, 0)]
+    >>> get_links(4, "star")
+    [(0, 1), (0, 2), (0, 3)]
+    """
+    if topology == "mesh":
+        return [(i, j) for i in range(size) for j in range(i + 1, size)]
+    elif topology == "line":
+        return [(i, i + 1) for i in range(size - 1)]
+    elif topology == "ring":
+        return [(i, (i + 1) % size) for i in range(size)] if size > 2 else get_links(size, "line")
+    elif topology == "star":
+        return [(0, i) for i in range(1, size)]
+    raise ValueError(f"Unknown topology {topology!r}, expected one of {topologies}")
+
+
+def submit(server: Server, command: Command) -> None:
+    """
+    Sends a command to a server, as a one-shot client would.
+    """
+    with socket.create_connection((server.address, server.port)) as connection:
+        connection.sendall(repr(command).encode() + frame_separator)
+
+
+class Cluster:
+
+    """
+    A set of servers living in this process, listening on local ports,
+    and connected to each other following a topology.
+    Their state is kept in memory.
+    If `profile` is passed, each server reaches its peers through a
+    proxy emulating a link with this profile, one per direction.
+    `options` are passed to each `OwnServer`.
+
+    Examples
+    --------
+    >>> with Cluster(range(6000, 6020), topology="ring") as cluster:  # doctest: +SKIP
+    ...     [peer.name for peer in cluster[0].peers]
+    ['6001', '6019']
+    """
+
+    def __init__(self,
+                 ports: Iterator[int],
+                 topology: str = "mesh",
+                 profile: Optional[LinkProfile] = None,
+                 **options):
+        self.servers = [
+            OwnServer("localhost", port, in_memory=True, **options)
+            for port in ports
+        ]
+        self.topology = topology
+        self.profile = profile
+        # Proxy on the link from a server to another, by their indices
+        self.proxies: dict[tuple[int, int], Proxy] = {}
+
+    def __getitem__(self, item: int) -> OwnServer:
+        return self.servers[item]
+
+    def __len__(self) -> int:
+        return len(self.servers)
+
+    def __enter__(self) -> Cluster:
+        self.listen()
+        return self
+
+    def __exit__(self, *_, **__) -> None:
+        self.close()
+
+    def listen(self) -> None:
+        links = get_links(len(self.servers), self.topology)
+        if self.profile is not None:
+            for i, j in links:
+                for source, destination in ((i, j), (j, i)):
+                    target = self.servers[destination]
+                    proxy = Proxy((target.address, target.port), self.profile)
+                    proxy.start()
+                    self.proxies[(source, destination)] = proxy
+                    self.servers[source].relays[target.name] = Server(proxy.address, proxy.port)
+        for server in self.servers:
+            server.listen()
+        # Once they all listen, so that they receive each other's state
+        for i, j in links:
+            self.servers[i].sync(self.servers[j])
+            self.servers[j].sync(self.servers[i])
+
+    def close(self) -> None:
+        for server in self.servers:
+            server.close()
+        for proxy in self.proxies.values():
+            proxy.stop()
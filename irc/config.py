@@ -2,4 +2,109 @@
 Contains settings used throughout the project.
 """
 
+from pathlib import Path
+
 network_buffer_size = 4096
+
+# Separator appended to each command sent over the network.
+# Persistent connections carry several commands, which are split on it.
+frame_separator = b"\n"
+
+# Directory containing the databases.
+# Each process gets its own file, named after its role and port,
+# so that processes running on the same host don't share it.
+database_directory = Path(__file__).parent / "databases"
+
+# How servers choose which of them hosts a channel:
+# - "origin": the server on which the channel was created,
+# - "consistent": the server on which its name falls on a consistent-hash ring.
+channel_placement = "origin"
+# Number of points (virtual nodes) each server has on the ring.
+ring_replicas = 128
+
+# Maximum number of commands the handler of a server takes from its queue
+# at once, to handle them in one pass: the database is read and written
+# once, and the replies to a client are pushed in one write.
+# When the server is idle, commands are handled one by one as they arrive.
+handler_batch_size = 64
+
+# Number of state changes a server keeps, so that a peer reconnecting
+# can resume from its last version instead of receiving a full snapshot.
+sync_log_size = 10000
+
+# Commands sent to another server are coalesced, and written together
+# once the oldest one waited `peer_flush_delay` seconds,
+# or once they add up to `peer_flush_bytes`, whichever comes first.
+peer_flush_delay = 0.002
+peer_flush_bytes = 16384
+
+# Compression of the links between servers, negotiated when they connect:
+# "zlib" to offer (and accept) it, "none" otherwise.
+link_compression = "zlib"
+link_compression_level = 6
+# Writes smaller than this (in bytes) are not compressed.
+link_compression_min_size = 128
+# Preset dictionary, made of strings commands are full of,
+# so that compression is effective from the first command.
+link_compression_dictionary = (
+    b'{"host": "", "channel": "#", "key": "", "members": "[]", "epoch": "", '
+    b'"version": "", "table": "channel", "state": "{\\"name\\": \\"#\\", '
+    b'\\"host\\": \\"\\", \\"key\\": \\"\\"}", "removed": ""}'
+    b':msg:{"content": "'
+    b'command:'
+)
+
+# Proportion of the commands entering the network which are traced:
+# they carry a trace id, and the time (in nanoseconds) of each step
+# they go through, which are written to `trace_file`.
+# Summarize them with `python -m tools.traces trace_file`.
+trace_sample_rate = 0.0
+trace_file = Path(__file__).parent / "traces.jsonl"
+
+# When joining a channel, a user can ask for its last messages,
+# or the ones sent since a time. They are sent by chunks of
+# `history_chunk_size` messages, and at most `history_replay_limit` are.
+history_chunk_size = 100
+history_replay_limit = 1000
+
+# Number of messages per page of the results of `/search`.
+search_page_size = 20
+
+# Retention of the history of the channels, None meaning no limit:
+# the age of the messages (in seconds), their number and their size
+# (of their contents, in bytes) in each channel.
+retention_max_age = None
+retention_max_messages = None
+retention_max_bytes = None
+# Limits on the history of all the channels together.
+retention_total_messages = None
+retention_total_bytes = None
+# Limits of specific channels, overriding the ones above,
+# e.g. {"#logs": {"max_age": 3600, "max_messages": None}}.
+retention_channels: dict[str, dict] = {}
+# Users away for longer than this (in seconds) are forgotten.
+presence_max_idle = 7 * 24 * 3600
+# Every `retention_interval` seconds, the server removes what exceeds
+# the limits, by batches of at most `retention_batch_size` objects
+# handled in between the commands.
+retention_interval = 10
+retention_batch_size = 500
+
+# Servers send a heartbeat to their peers every `heartbeat_interval`
+# seconds, to measure the latency and loss of the links between them.
+# A peer which did not answer for `heartbeat_timeout` seconds is
+# considered down, and the paths through it are replaced.
+heartbeat_interval = 1.0
+heartbeat_timeout = 3.0
+# Number of heartbeats the loss of a link is measured on.
+heartbeat_window = 20
+# The cost of a link is its round-trip time multiplied by
+# 1 + `heartbeat_loss_penalty` * its loss.
+heartbeat_loss_penalty = 10
+
+# Memory diagnostics, started from the console of the server
+# (see `irc.memory`): allocations are traced with `memory_trace_frames`
+# frames of traceback, to tell which subsystem made them, and the gauges
+# are written every `memory_gauges_interval` seconds.
+memory_trace_frames = 16
+memory_gauges_interval = 10.0
@@ -1,30 +1,96 @@
 from __future__ import annotations
 
-from typing import Callable, Optional, TypeVar
+import threading as th
+
+from typing import TYPE_CHECKING, Callable, Iterator, Optional, TypeVar
 from pathlib import Path
-from tinydb import TinyDB
-from tinydb.table import Document
-from functools import wraps
+from contextlib import contextmanager
 
-from ..design import Singleton
+from ..config import database_directory
 from .._utils import SupportsComparison
 
+if TYPE_CHECKING:
+    from tinydb import TinyDB
+    from tinydb.queries import QueryLike
+    from tinydb.table import Document
+
 
 _T = TypeVar("_T")
 
+# Databases bound to the current thread, see `Database.bind`
+_bound = th.local()
+
 
 def _get_table_name(obj) -> str:
     return obj.__table_name__
 
 
-class Database(Singleton):
+def get_location(role: str, *names: str | int, suffix: str = ".tinydb") -> Path:
+    """
+    Returns the path of the database used by a process, namespaced by its
+    role (`client` or `server`) and names (port, nickname...).
+    Files related to it (e.g. snapshots) only differ by their suffix.
+
+    Examples
+    --------
+    >>> get_location("server", 6667).name
+    'server-6667.tinydb'
+    >>> get_location("client", 6667, "alice").name
+    'client-6667-alice.tinydb'
+    >>> get_location("server", 6667, suffix=".snapshot").name
+    'server-6667.snapshot'
+    """
+    name = "-".join(map(str, (role, *names)))
+    return database_directory / f"{name}{suffix}"
+
+
+class Database:
 
     """
     Simple, generic interface to access a TinyDB file.
-    Database logic is implemented in the objects.
+    Database logic is implemented in the objects, which use the database
+    returned by `Database.current()`.
+
+    If `location` is None, the data is only kept in memory.
+
+    It can be used by several threads: reads never wait, and writes only
+    wait for the other writes to the same table (see `VersionedMiddleware`).
     """
 
     _db: TinyDB
+    location: Optional[Path]
+
+    _default: Optional[Database] = None
+
+    def __init__(self, location: Optional[Path] = None):
+        self._db = None
+        self.open(location)
+
+    @classmethod
+    def current(cls) -> Database:
+        """
+        Returns the database bound to the current thread,
+        otherwise the process-wide default one.
+        """
+        database = getattr(_bound, "database", None)
+        if database is not None:
+            return database
+        if cls._default is None:
+            cls._default = cls()
+        return cls._default
+
+    def bind(self) -> None:
+        """
+        Makes this database the one used by the objects in the current thread.
+        This is how several servers can live in the same process.
+        """
+        _bound.database = self
+
+    def set_default(self) -> None:
+        """
+        Makes this database the one used by threads that did not bind any.
+        """
+        Database._default = self
 
     def __enter__(self) -> Database:
         return self
@@ -32,11 +98,72 @@ class Database(Singleton):
     def __exit__(self, *_, **__) -> None:
         pass
 
-    def search(self, *args, **kwargs):
-        return self._db.search(*args, **kwargs)
+    def search(self, obj: _T, query: QueryLike) -> list[Document]:
+        return self._db.table(_get_table_name(obj)).search(query)
+
+    def open(self, location: Optional[Path]) -> None:
+        """
+        Opens the database stored at `location`.
+        If it is None, the database is kept in memory, and is lost on exit.
+        """
+        if self._db is not None:
+            self._db.close()
+        self.location = location
+        # TinyDB is only imported once a database is opened
+        from tinydb.storages import JSONStorage, MemoryStorage
+        from ._storage import VersionedMiddleware, _TinyDB
+        if location is None:
+            self._db = _TinyDB(storage=VersionedMiddleware(MemoryStorage))
+        else:
+            self._db = _TinyDB(location, create_dirs=True, storage=VersionedMiddleware(JSONStorage))
+
+    @contextmanager
+    def batch(self) -> Iterator[Database]:
+        """
+        Groups the operations made in this context: the database is
+        written once when exiting it. Batches can be nested.
+        The other threads see the changes as they are made.
+        """
+        self._db.storage.begin()
+        try:
+            yield self
+        finally:
+            self._db.storage.end()
+
+    def dump(self) -> dict[str, dict[str, dict]]:
+        """
+        Returns the content of the database: the documents of each table,
+        by identifier. It must not be modified.
+        """
+        return self._db.storage.read()
+
+    def load(self, content: dict[str, dict[str, dict]]) -> None:
+        """
+        Replaces the content of the database by `content`, as returned
+        by `dump`, which the storage already holds: it is not written to
+        it, and the storage is not read.
+        """
+        self._db.storage.load(content)
+
+    def get_lock_stats(self) -> dict[str, dict[str, float]]:
+        """
+        Returns, for the lock of each table and the one taken to write
+        to the storage, how many times it was taken, how many of them had
+        to wait, and the total and maximum wait, in seconds.
+        """
+        return self._db.storage.get_lock_stats()
 
-    def init(self):
-        self._db = TinyDB(Path(__file__).parent.parent / "database.tinydb")  # FIXME
+    def get_stats(self) -> dict[str, tuple[int, int]]:
+        """
+        Returns the number of documents of each table,
+        and the number of query results TinyDB caches for it
+        (for the calling thread).
+        """
+        stats = {}
+        for name in self._db.tables():
+            table = self._db.table(name)
+            stats[name] = (len(table), len(getattr(table, "_query_cache", ())))
+        return stats
 
     def get_by_id(self, obj: _T, identifier: int) -> Document:
         return self._db.table(_get_table_name(obj)).get(doc_id=identifier)
@@ -44,6 +171,13 @@ class Database(Singleton):
     def get_all(self, obj: _T) -> list[Document]:
         return self._db.table(_get_table_name(obj)).all()
 
+    def get_ids(self, obj: _T) -> list[int]:
+        """
+        Returns the identifiers of the documents of the table of `obj`,
+        without reading the documents.
+        """
+        return list(map(int, self._db.table(_get_table_name(obj))._read_table()))
+
     def is_known(self, obj: _T) -> bool:
         return self._db.table(_get_table_name(obj)).contains(doc_id=obj.id)
 
@@ -52,12 +186,52 @@ class Database(Singleton):
     ) -> Optional[Document]:
         return sorted(self._db.table(_get_table_name(obj)).all(), key=key)[0]
 
+    def insert_all(self, obj: _T, documents: dict[int, dict]) -> None:
+        """
+        Replaces the content of the table of `obj` by `documents`,
+        mapping the documents identifiers to their content.
+        """
+        from tinydb.table import Document
+        name = _get_table_name(obj)
+        with self._db.storage.writing(name):
+            table = self._db.table(name)
+            table.truncate()
+            table.insert_multiple(
+                Document(document, doc_id=doc_id)
+                for doc_id, document in documents.items()
+            )
+
     def upsert(self, obj: _T) -> None:
         """
         Takes any object from Sami and inserts/updates the information
         in the database.
         """
-        self._db.table(_get_table_name(obj)).upsert(Document(obj.dict(), doc_id=obj.id))
+        name = _get_table_name(obj)
+        document = obj.dict()
+
+        def replace(table: dict) -> None:
+            table[obj.id] = document
+
+        with self._db.storage.writing(name):
+            # In one pass, and without modifying the document in place
+            # as `Table.upsert` does, as others might be reading it.
+            self._db.table(name)._update_table(replace)
 
     def remove(self, obj: _T) -> None:
-        self._db.table(_get_table_name(obj)).remove(obj.id)
+        name = _get_table_name(obj)
+        with self._db.storage.writing(name):
+            self._db.table(name).remove(doc_ids=[obj.id])
+
+    def remove_all(self, obj: _T, identifiers: list[int]) -> None:
+        """
+        Removes the documents of the table of `obj` with these identifiers,
+        in one write.
+        """
+        name = _get_table_name(obj)
+        with self._db.storage.writing(name):
+            table = self._db.table(name)
+            try:
+                table.remove(doc_ids=identifiers)
+            except KeyError:
+                # Some were removed already, which older versions of TinyDB reject
+                table.remove(doc_ids=[identifier for identifier in identifiers if table.contains(doc_id=identifier)])
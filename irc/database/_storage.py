@@ -0,0 +1,233 @@
+"""
+The TinyDB storage behind `Database`, made safe for concurrent readers
+and writers. TinyDB takes long to import: this module is only loaded
+once a database is opened.
+"""
+
+from __future__ import annotations
+
+import time
+import threading as th
+
+from collections import OrderedDict
+from typing import Iterator, Optional
+from contextlib import contextmanager
+from tinydb import TinyDB
+from tinydb.middlewares import Middleware
+from tinydb.table import Table
+from tinydb.utils import LRUCache
+
+
+class MeasuredLock:
+
+    """
+    Lock which counts how often it had to be waited for, and for how long.
+    """
+
+    def __init__(self):
+        self._lock = th.Lock()
+        self.acquisitions = 0
+        self.contended = 0  # Acquisitions which had to wait
+        self.wait = 0.0  # Total time waited, in seconds
+        self.max_wait = 0.0
+
+    def __enter__(self) -> MeasuredLock:
+        if not self._lock.acquire(blocking=False):
+            start = time.perf_counter()
+            self._lock.acquire()
+            waited = time.perf_counter() - start
+            # Counted once we hold the lock, so that counts are not lost
+            self.contended += 1
+            self.wait += waited
+            self.max_wait = max(self.max_wait, waited)
+        self.acquisitions += 1
+        return self
+
+    def __exit__(self, *_, **__) -> None:
+        self._lock.release()
+
+    def get_stats(self) -> dict[str, float]:
+        return {
+            "acquisitions": self.acquisitions,
+            "contended": self.contended,
+            "wait": self.wait,
+            "max_wait": self.max_wait,
+        }
+
+
+class VersionedMiddleware(Middleware):
+
+    """
+    Storage wrapper letting threads read and write the database
+    concurrently.
+
+    The content of the storage is read once, and then kept in memory as
+    a version which is never modified: readers get the current version,
+    without taking any lock. Writers of a table are serialized by its
+    lock (see `writing`), and get a copy of the current version; when
+    they write it back, their table replaces the one of the current
+    version, in a new version.
+
+    Versions are written to the storage as they are made, or, during
+    a batch (see `Database.batch`), once at the end of the batch.
+    """
+
+    def __init__(self, storage_cls):
+        super().__init__(storage_cls)
+        # Number of the current version, and its content,
+        # loaded on the first read
+        self._current: tuple[int, Optional[dict]] = (0, None)
+        self._load_lock = th.Lock()
+        # Taken to make a version, and write it to the storage
+        self._commit_lock = MeasuredLock()
+        self._table_locks: dict[str, MeasuredLock] = {}
+        self._table_locks_lock = th.Lock()
+        self._dirty = False  # Whether a version was not written yet
+        # Per thread: the number of the version it last read, the table
+        # it is writing, and the number of nested batches it is in.
+        self._local = th.local()
+
+    @property
+    def number(self) -> int:
+        return self._current[0]
+
+    def _get_version(self) -> tuple[int, dict]:
+        if self._current[1] is None:
+            with self._load_lock:
+                if self._current[1] is None:
+                    self._current = (0, self.storage.read() or {})
+        return self._current
+
+    @contextmanager
+    def writing(self, table: str) -> Iterator[None]:
+        """
+        Within this context, the current thread is the only one writing
+        to `table`.
+        """
+        lock = self._table_locks.get(table)
+        if lock is None:
+            with self._table_locks_lock:
+                lock = self._table_locks.setdefault(table, MeasuredLock())
+        with lock:
+            self._local.table = table
+            try:
+                yield
+            finally:
+                self._local.table = None
+
+    def begin(self) -> None:
+        self._local.depth = getattr(self._local, "depth", 0) + 1
+
+    def end(self) -> None:
+        self._local.depth -= 1
+        if self._local.depth:
+            return
+        with self._commit_lock:
+            if self._dirty:
+                self.storage.write(self._current[1])
+                self._dirty = False
+
+    def read(self):
+        number, version = self._get_version()
+        self._local.read = number
+        if getattr(self._local, "table", None) is None:
+            return version
+        # TinyDB replaces the table it writes in what it read:
+        # it must not be the version the others read.
+        return dict(version)
+
+    def write(self, data) -> None:
+        table = getattr(self._local, "table", None)
+        with self._commit_lock:
+            number, version = self._get_version()
+            if table is None:
+                version = data
+            else:
+                version = dict(version)
+                version[table] = data[table]
+            self._current = (number + 1, version)
+            if getattr(self._local, "depth", 0):
+                self._dirty = True
+            else:
+                self.storage.write(version)
+                self._dirty = False
+
+    def load(self, data: dict) -> None:
+        """
+        Makes `data` the current version, without writing it to the
+        storage, which must already hold it (e.g. read from a snapshot
+        of it), rather than reading the storage.
+        """
+        with self._commit_lock:
+            self._current = (self._current[0] + 1, data)
+
+    def get_last_read(self) -> Optional[int]:
+        """
+        Returns the number of the version the current thread last read.
+        """
+        return getattr(self._local, "read", None)
+
+    def get_lock_stats(self) -> dict[str, dict[str, float]]:
+        """
+        Returns how much the lock of each table, and the one taken to
+        make a version (`commit`), were contended.
+        """
+        with self._table_locks_lock:
+            locks = dict(self._table_locks)
+        return {
+            "commit": self._commit_lock.get_stats(),
+            **{table: lock.get_stats() for table, lock in locks.items()},
+        }
+
+    def close(self) -> None:
+        self.storage.close()
+
+
+class _QueryCache(LRUCache):
+
+    """
+    Cache of the results of the queries of a table, which can be used by
+    several threads: each has its own, so that they don't wait for each
+    other, and results are only returned while the version of the
+    database they were computed from is the current one.
+    """
+
+    storage: VersionedMiddleware  # Set by the table
+
+    def __init__(self, capacity=None):
+        self._local = th.local()
+        super().__init__(capacity)
+
+    @property
+    def cache(self) -> OrderedDict:
+        cache = getattr(self._local, "cache", None)
+        if cache is None:
+            cache = self._local.cache = OrderedDict()
+        return cache
+
+    @cache.setter
+    def cache(self, cache: OrderedDict) -> None:
+        self._local.cache = cache
+
+    def get(self, key, default=None):
+        entry = super().get(key)
+        if entry is None or entry[0] != self.storage.number:
+            return default
+        return entry[1]
+
+    def set(self, key, value) -> None:
+        super().set(key, (self.storage.get_last_read(), value))
+
+
+class _Table(Table):
+
+    query_cache_class = _QueryCache
+
+    def __init__(self, storage: VersionedMiddleware, *args, **kwargs):
+        super().__init__(storage, *args, **kwargs)
+        self._query_cache.storage = storage
+
+
+class _TinyDB(TinyDB):
+
+    table_class = _Table
@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from threading import Lock
+from threading import RLock
 
 
 class SingletonMeta(type):
@@ -12,10 +12,11 @@ class SingletonMeta(type):
 
     __instances = {}
 
-    __lock: Lock = Lock()
+    __lock: RLock = RLock()
     """
     We now have a lock object that will be used to synchronize threads during
     first access to the Singleton.
+    It is reentrant, as a singleton can create another one when initialized.
     """
 
     def __call__(cls, *args, **kwargs):
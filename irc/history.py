@@ -0,0 +1,149 @@
+"""
+History of the messages sent to the channels, replayed when joining them.
+"""
+
+from __future__ import annotations
+
+from bisect import bisect_left, bisect_right
+from typing import TYPE_CHECKING, Iterator, Optional
+
+from .config import history_chunk_size, history_replay_limit
+from .database import Database
+from . import objects
+from .search import SearchIndex
+
+if TYPE_CHECKING:
+    from .objects import Message
+
+
+def get_size(message: dict) -> int:
+    """
+    Returns the size of the content of a message, in bytes.
+    """
+    return len(message["content"].encode())
+
+
+class History:
+
+    """
+    Messages of the channels, stored in the database, and indexed by
+    channel and time in memory: for each channel, the timestamps of its
+    messages are kept sorted, next to the messages themselves.
+    Finding where a replay starts is then a binary search, so replaying
+    `k` messages out of `n` costs O(log n + k).
+
+    The messages are also indexed by word, to search them (see `index`).
+
+    The indexes are built from the database once, without validating the
+    messages, and then maintained as messages are added.
+    """
+
+    def __init__(self, database: Database):
+        self.database = database
+        self.index = SearchIndex()
+        self._timestamps: dict[str, list[int]] = {}
+        self._messages: dict[str, list[dict]] = {}
+        self._numbers: dict[str, list[int]] = {}  # In the search index
+        # Size of the contents of the messages of each channel, in bytes
+        self.sizes: dict[str, int] = {}
+        # Number of messages, and size of their contents, of all the channels
+        self._length = 0
+        self.size = 0
+        documents = sorted(database.get_all(objects.Message), key=lambda document: document["timestamp"])
+        for document in map(dict, documents):
+            self._timestamps.setdefault(document["channel"], []).append(document["timestamp"])
+            self._messages.setdefault(document["channel"], []).append(document)
+            self._numbers.setdefault(document["channel"], []).append(self.index.add(document))
+            self.sizes[document["channel"]] = self.sizes.get(document["channel"], 0) + get_size(document)
+            self._length += 1
+            self.size += get_size(document)
+
+    def __len__(self) -> int:
+        return self._length
+
+    @property
+    def channels(self) -> list[str]:
+        return list(self._timestamps)
+
+    def count(self, channel: str) -> int:
+        return len(self._timestamps.get(channel, []))
+
+    def get_oldest(self, channel: str, count: int) -> list[dict]:
+        """
+        Returns the `count` oldest messages of `channel`.
+        """
+        return self._messages.get(channel, [])[:count]
+
+    def add(self, message: Message) -> None:
+        """
+        Stores a message, and indexes it.
+        """
+        self.database.upsert(message)
+        timestamps = self._timestamps.setdefault(message.channel, [])
+        messages = self._messages.setdefault(message.channel, [])
+        # Messages mostly arrive in order, in which case this appends
+        position = bisect_right(timestamps, message.timestamp)
+        document = message.dict()
+        timestamps.insert(position, message.timestamp)
+        messages.insert(position, document)
+        self._numbers.setdefault(message.channel, []).insert(position, self.index.add(document))
+        self.sizes[message.channel] = self.sizes.get(message.channel, 0) + get_size(document)
+        self._length += 1
+        self.size += get_size(document)
+
+    def evict(self, channel: str, count: int) -> None:
+        """
+        Removes the `count` oldest messages of `channel`.
+        """
+        messages = self._messages[channel][:count]
+        for number in self._numbers[channel][:count]:
+            self.index.remove(number)
+        for sequence in (self._timestamps, self._messages, self._numbers):
+            del sequence[channel][:count]
+        size = sum(map(get_size, messages))
+        self.sizes[channel] -= size
+        self._length -= len(messages)
+        self.size -= size
+        if not self._timestamps[channel]:
+            for mapping in (self._timestamps, self._messages, self._numbers, self.sizes):
+                del mapping[channel]
+        self.database.remove_all(objects.Message, [objects.Message(**message).id for message in messages])
+
+    def count_since(self, channel: str, timestamp: int) -> int:
+        """
+        Returns the number of messages of `channel` sent before `timestamp`.
+        """
+        return bisect_left(self._timestamps.get(channel, []), timestamp)
+
+    def replay(self,
+               channel: str,
+               count: Optional[int] = None,
+               since: Optional[int] = None,
+               chunk_size: int = history_chunk_size,
+               ) -> Iterator[list[dict]]:
+        """
+        Yields the messages of `channel`, oldest first, by chunks of at most
+        `chunk_size`: the last `count` ones, and / or the ones sent since the
+        timestamp `since`. At most `config.history_replay_limit` messages
+        are replayed.
+
+        Examples
+        --------
+        >>> history = History(Database())
+        >>> for i in range(5):
+        ...     history.add(objects.Message(author="alice", channel="#a", content=str(i), timestamp=i))
+        >>> [[message["content"] for message in chunk] for chunk in history.replay("#a", count=3, chunk_size=2)]
+        [['2', '3'], ['4']]
+        >>> [message["content"] for chunk in history.replay("#a", since=4) for message in chunk]
+        ['4']
+        """
+        timestamps = self._timestamps.get(channel, [])
+        messages = self._messages.get(channel, [])
+        end = len(timestamps)
+        start = max(0, end - history_replay_limit)
+        if count is not None:
+            start = max(start, end - count)
+        if since is not None:
+            start = max(start, bisect_left(timestamps, since))
+        for position in range(start, end, chunk_size):
+            yield messages[position:min(position + chunk_size, end)]
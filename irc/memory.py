@@ -0,0 +1,229 @@
+"""
+Memory diagnostics of a server, driven from its console
+(see the `memory` commands of `server.py`).
+
+Allocations are traced with `tracemalloc`, and attributed to the
+subsystem of the server which made them (see `subsystems`), from the
+innermost frame of their traceback which belongs to one. Two snapshots
+can be compared to find what grows. Gauges (the resident memory, the
+number of objects, the size of the queues and caches) are written over
+time to a file, one JSON object per line.
+"""
+
+from __future__ import annotations
+
+import gc
+import os
+import sys
+import time
+import inspect
+import importlib
+import tracemalloc
+
+from json import JSONEncoder
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional
+
+from .config import memory_trace_frames, memory_gauges_interval
+from .threads import BaseThread
+
+if TYPE_CHECKING:
+    from ._server import OwnServer
+
+
+# Subsystem, and the parts of the paths of the files allocating for it.
+# The first subsystem one of the frames of an allocation matches wins.
+subsystems: list[tuple[str, tuple[str, ...]]] = [
+    ("network", ("irc/_links.py", "irc/capture.py", "irc/routing.py", "irc/netem.py", "/socket.py", "/selectors.py")),
+    ("queues", ("/queue.py", )),
+    ("store", ("irc/database/", "/tinydb/", "irc/snapshot.py")),
+    ("caches", ("irc/history.py", "irc/search.py", "irc/symbols.py", "irc/retention.py")),
+    ("objects", ("irc/_objects.py", "/pydantic/")),
+    ("handlers", ("irc/_server.py", "irc/_handler.py", "irc/tracing.py")),
+]
+
+
+# Classes of modules belonging to another subsystem than the rest of them
+regions: list[tuple[str, str, str]] = [
+    ("irc._server", "ConnectionThread", "network"),
+    ("irc._server", "HandlerThread", "queues"),
+]
+_spans: Optional[list[tuple[str, range, str]]] = None  # Lines of the regions
+
+
+def _get_spans() -> list[tuple[str, range, str]]:
+    global _spans
+    if _spans is None:
+        _spans = []
+        for module, name, subsystem in regions:
+            obj = getattr(importlib.import_module(module), name)
+            lines, start = inspect.getsourcelines(obj)
+            _spans.append((inspect.getsourcefile(obj), range(start, start + len(lines)), subsystem))
+    return _spans
+
+
+def get_subsystem(traceback: tracemalloc.Traceback) -> tuple[str, tracemalloc.Frame]:
+    """
+    Returns the subsystem which made an allocation, or "other",
+    and the frame it was told from.
+    """
+    spans = _get_spans()
+    # Tracebacks are ordered from the oldest frame
+    for frame in reversed(traceback):
+        for filename, lines, subsystem in spans:
+            if frame.lineno in lines and frame.filename == filename:
+                return subsystem, frame
+        filename = frame.filename.replace(os.sep, "/")
+        for subsystem, patterns in subsystems:
+            if any(pattern in filename for pattern in patterns):
+                return subsystem, frame
+    return "other", traceback[-1]
+
+
+def get_rss() -> int:
+    """
+    Returns the resident memory of this process, in bytes.
+    Where `/proc` is not available, this is its peak instead.
+    """
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # In kilobytes on Linux, bytes on macOS
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+class MemoryDiagnostics:
+
+    """
+    Traces the allocations of a server, and records its gauges.
+    """
+
+    def __init__(self, server: OwnServer, path: Path):
+        """
+        `path` is the file the gauges are written to.
+        """
+        self.server = server
+        self.path = path
+        # The last two snapshots taken, the most recent last
+        self.snapshots: list[tracemalloc.Snapshot] = []
+        self._gauges_thread: Optional[GaugesThread] = None
+
+    @property
+    def tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def start(self, interval: float = memory_gauges_interval) -> None:
+        """
+        Starts tracing the allocations, and recording the gauges
+        every `interval` seconds.
+        """
+        if not self.tracing:
+            _get_spans()  # Reads the sources, before it would be traced
+            tracemalloc.start(memory_trace_frames)
+        if self._gauges_thread is None:
+            self._gauges_thread = GaugesThread(self, interval)
+            self._gauges_thread.start()
+
+    def stop(self) -> None:
+        if self._gauges_thread is not None:
+            self._gauges_thread.stop()
+            self._gauges_thread.join()
+            self._gauges_thread = None
+        self.snapshots = []
+        tracemalloc.stop()
+
+    def snapshot(self) -> dict[str, tuple[int, int]]:
+        """
+        Takes a snapshot of the allocations, and returns the size
+        (in bytes) and number of the live ones, by subsystem.
+        """
+        if not self.tracing:
+            raise RuntimeError("Memory tracing is not started")
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            # Not the ones made by tracemalloc itself
+            tracemalloc.Filter(False, tracemalloc.__file__),
+        ])
+        self.snapshots = [*self.snapshots[-1:], snapshot]
+        usage = {}
+        for statistic in snapshot.statistics("traceback"):
+            subsystem, _ = get_subsystem(statistic.traceback)
+            size, count = usage.get(subsystem, (0, 0))
+            usage[subsystem] = (size + statistic.size, count + statistic.count)
+        return dict(sorted(usage.items(), key=lambda item: -item[1][0]))
+
+    def diff(self, limit: int = 10) -> tuple[dict[str, int], list[tuple[str, str, int, int]]]:
+        """
+        Compares the last two snapshots. Returns the growth (in bytes)
+        of each subsystem, and the `limit` places which grew the most:
+        their subsystem, location, growth in bytes and in allocations.
+        """
+        if len(self.snapshots) < 2:
+            raise RuntimeError("Two snapshots are needed to compare them")
+        before, after = self.snapshots
+        growth = {}
+        places = []
+        for statistic in after.compare_to(before, "traceback"):
+            if not statistic.size_diff:
+                continue
+            subsystem, frame = get_subsystem(statistic.traceback)
+            growth[subsystem] = growth.get(subsystem, 0) + statistic.size_diff
+            places.append((subsystem, f"{frame.filename}:{frame.lineno}",
+                           statistic.size_diff, statistic.count_diff))
+        places.sort(key=lambda place: -place[2])
+        return dict(sorted(growth.items(), key=lambda item: -item[1])), places[:limit]
+
+    def get_gauges(self) -> dict[str, float]:
+        """
+        Returns the current values of the gauges.
+        """
+        server = self.server
+        gauges = {
+            "time": time.time(),
+            "rss": get_rss(),
+            "objects": len(gc.get_objects()),
+            "handle_queue": server.handle_queue.qsize(),
+            "clients": len(server.clients),
+            "links": len(server.links),
+            "link_frames": sum(len(link._frames) for link in list(server.links.values())),
+            "history": len(server.history),
+        }
+        tables = server.database.get_stats().values()
+        gauges["documents"] = sum(documents for documents, _ in tables)
+        gauges["cached_queries"] = sum(queries for _, queries in tables)
+        locks = server.database.get_lock_stats().values()
+        gauges["database_contended"] = sum(lock["contended"] for lock in locks)
+        gauges["database_wait"] = sum(lock["wait"] for lock in locks)
+        gauges.update({
+            f"membership_{key}": value for key, value in server.membership.get_memory_report().items()
+        })
+        if self.tracing:
+            gauges["traced"], gauges["traced_peak"] = tracemalloc.get_traced_memory()
+        return gauges
+
+    def record(self) -> None:
+        """
+        Appends the current values of the gauges to the file.
+        """
+        with self.path.open("a") as file:
+            file.write(JSONEncoder().encode(self.get_gauges()) + "\n")
+
+
+class GaugesThread(BaseThread):
+
+    """
+    Records the gauges every `interval` seconds.
+    """
+
+    def __init__(self, diagnostics: MemoryDiagnostics, interval: float):
+        super().__init__()
+        self.diagnostics = diagnostics
+        self.interval = interval
+
+    def run(self):
+        while self.running:
+            self.diagnostics.record()
+            if self._local_stop_event.wait(self.interval):
+                break
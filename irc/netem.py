@@ -0,0 +1,247 @@
+"""
+Emulation of the network between servers.
+
+Servers all run on localhost, where links have no latency and no loss,
+which hides the problems of real networks. A `Proxy` sits on a link
+(servers are told to reach a peer through it, see `OwnServer.relays`),
+and forwards what goes through it after a delay, as specified by a
+`LinkProfile`: latency, jitter, limited bandwidth, and stalls.
+
+As the links are TCP connections, packets are never lost: a lost packet
+is sent again after a timeout, delaying it and everything behind it.
+This is what stalls emulate.
+"""
+
+from __future__ import annotations
+
+import time
+import socket
+import random
+import threading as th
+
+from collections import deque
+from typing import Optional
+
+from .config import network_buffer_size
+from .threads import BaseThread
+from ._utils import Printer
+
+printer = Printer(verbose=4)
+
+
+class LinkProfile:
+
+    """
+    Characteristics of an emulated link, in each direction.
+    `latency` and `jitter` are in seconds, `bandwidth` in bytes per second
+    (None meaning unlimited). Each chunk read from the connection is
+    delayed by the latency, plus or minus a random part of the jitter,
+    and, with probability `stall_probability`, by `stall_duration` more.
+    """
+
+    def __init__(self,
+                 latency: float = 0.0,
+                 jitter: float = 0.0,
+                 bandwidth: Optional[float] = None,
+                 stall_probability: float = 0.0,
+                 stall_duration: float = 0.2,
+                 seed: Optional[int] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.stall_probability = stall_probability
+        self.stall_duration = stall_duration
+        self.random = random.Random(seed)
+
+    def __repr__(self):
+        return (f"LinkProfile(latency={self.latency}, jitter={self.jitter}, "
+                f"bandwidth={self.bandwidth}, stall_probability={self.stall_probability}, "
+                f"stall_duration={self.stall_duration})")
+
+    def get_delay(self) -> tuple[float, bool]:
+        """
+        Returns the delay of a chunk, and whether it stalled.
+
+        Examples
+        --------
+        >>> LinkProfile(latency=0.05).get_delay()
+        (0.05, False)
+        >>> delay, stalled = LinkProfile(latency=0.05, stall_probability=1).get_delay()
+        >>> round(delay, 2), stalled
+        (0.25, True)
+        """
+        delay = self.latency
+        if self.jitter:
+            delay = max(0.0, delay + self.random.uniform(-self.jitter, self.jitter))
+        stalled = self.random.random() < self.stall_probability
+        if stalled:
+            delay += self.stall_duration
+        return delay, stalled
+
+
+class _Pipe(BaseThread):
+
+    """
+    Forwards what is read from `source` to `destination`, through the
+    link emulated by `proxy`. Reading and delivering are done by two
+    threads, so that what is read is not delayed by what is delivered.
+    """
+
+    def __init__(self, proxy: Proxy, source: socket.socket, destination: socket.socket):
+        super().__init__()
+        self.proxy = proxy
+        self.source = source
+        self.destination = destination
+        # Chunks read, and when they should be delivered
+        self._chunks: deque[Optional[tuple[float, bytes]]] = deque()
+        self._condition = th.Condition()
+        self._last = 0.0  # When the last chunk read should be delivered
+        self._free = 0.0  # When the link is done sending the last chunk
+
+    def run(self):
+        deliver = th.Thread(target=self._deliver, name="ProxyDelivery", daemon=True)
+        deliver.start()
+        while self.running:
+            try:
+                data = self.source.recv(network_buffer_size)
+            except OSError:
+                break
+            if not data:
+                break
+            delay, stalled = self.proxy.profile.get_delay()
+            # TCP delivers in order: a chunk can't overtake the previous one
+            self._last = max(time.monotonic() + delay, self._last)
+            self.proxy.account(len(data), stalled)
+            with self._condition:
+                self._chunks.append((self._last, data))
+                self._condition.notify()
+        with self._condition:
+            self._chunks.append(None)  # End of the stream
+            self._condition.notify()
+
+    def _deliver(self) -> None:
+        bandwidth = self.proxy.profile.bandwidth
+        while True:
+            with self._condition:
+                while not self._chunks:
+                    self._condition.wait()
+                chunk = self._chunks.popleft()
+            if chunk is None:
+                break
+            deliver_at, data = chunk
+            if bandwidth:
+                # The chunk is sent once the previous ones are,
+                # and takes the time its size needs at this bandwidth.
+                start = max(deliver_at, self._free)
+                deliver_at = start + len(data) / bandwidth
+                self._free = deliver_at
+            remaining = deliver_at - time.monotonic()
+            if remaining > 0:
+                time.sleep(remaining)
+            try:
+                self.destination.sendall(data)
+            except OSError:
+                break
+        try:
+            self.destination.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+
+
+class Proxy(BaseThread):
+
+    """
+    Listens on `address` (by default, a free port on localhost), and
+    forwards each connection to `target`, through a link emulated
+    following `profile` in both directions.
+
+    Examples
+    --------
+    >>> target = socket.create_server(("localhost", 0))
+    >>> proxy = Proxy(target.getsockname(), LinkProfile(latency=0.05))
+    >>> proxy.start()
+    >>> client = socket.create_connection(("localhost", proxy.port))
+    >>> connection, _ = target.accept()
+    >>> start = time.monotonic()
+    >>> client.sendall(b"hello")
+    >>> connection.recv(5), time.monotonic() - start >= 0.05
+    (b'hello', True)
+    >>> proxy.stop()
+
+    At 10 kB/s, 2 kB take 0.2 seconds, even on an idle link:
+
+    >>> proxy = Proxy(target.getsockname(), LinkProfile(bandwidth=10_000))
+    >>> proxy.start()
+    >>> client = socket.create_connection(("localhost", proxy.port))
+    >>> connection, _ = target.accept()
+    >>> start = time.monotonic()
+    >>> client.sendall(bytes(2000))
+    >>> received = b""
+    >>> while len(received) < 2000:
+    ...     received += connection.recv(2000)
+    >>> time.monotonic() - start >= 0.2
+    True
+    >>> proxy.stop()
+    """
+
+    def __init__(self,
+                 target: tuple[str, int],
+                 profile: LinkProfile,
+                 address: tuple[str, int] = ("localhost", 0)):
+        super().__init__()
+        self.target = target
+        self.profile = profile
+        self._socket = socket.create_server(address)
+        # We don't block indefinitely, so that we stop accepting
+        # connections once the proxy is stopped.
+        self._socket.settimeout(1)
+        self.address, self.port = self._socket.getsockname()[:2]
+        self._connections: list[socket.socket] = []
+        self._lock = th.Lock()
+        # Counters, for both directions
+        self.bytes = 0
+        self.chunks = 0
+        self.stalls = 0
+
+    def account(self, size: int, stalled: bool) -> None:
+        with self._lock:
+            self.bytes += size
+            self.chunks += 1
+            self.stalls += stalled
+
+    def get_stats(self) -> dict[str, int]:
+        with self._lock:
+            return {"bytes": self.bytes, "chunks": self.chunks, "stalls": self.stalls}
+
+    def run(self):
+        with self._socket:
+            while self.running:
+                try:
+                    connection, _ = self._socket.accept()
+                except socket.timeout:
+                    continue
+                except OSError:
+                    break
+                connection.settimeout(None)
+                try:
+                    upstream = socket.create_connection(self.target, timeout=5)
+                except OSError:
+                    printer.error(f"Proxy could not reach {self.target}")
+                    connection.close()
+                    continue
+                upstream.settimeout(None)
+                with self._lock:
+                    self._connections.extend((connection, upstream))
+                _Pipe(self, connection, upstream).start()
+                _Pipe(self, upstream, connection).start()
+
+    def stop(self):
+        super().stop()
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            connection.close()
@@ -0,0 +1,68 @@
+"""
+Consistent hashing of the channels onto the servers of the network.
+"""
+
+from __future__ import annotations
+
+from bisect import bisect, insort
+from typing import Iterable, Optional
+
+from .config import ring_replicas
+from ._utils import get_hash
+
+
+def _get_point(key: str) -> int:
+    return int(get_hash(key.encode())[:16], 16)
+
+
+class HashRing:
+
+    """
+    Places keys (channel names) on nodes (server names).
+
+    Each node owns `replicas` points on the ring, and a key belongs to
+    the node owning the first point following its own hash.
+    Adding or removing a node therefore only moves the keys
+    around its points, about 1/N of them.
+
+    Examples
+    --------
+    >>> ring = HashRing(["6667", "6668", "6669"])
+    >>> ring.get("#general") in ring.nodes
+    True
+    """
+
+    def __init__(self, nodes: Iterable[str] = (), replicas: int = ring_replicas):
+        self.replicas = replicas
+        self.nodes: set[str] = set()
+        self._points: list[int] = []
+        self._owners: dict[int, str] = {}
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node: str) -> None:
+        if node in self.nodes:
+            return
+        self.nodes.add(node)
+        for replica in range(self.replicas):
+            point = _get_point(f"{node}#{replica}")
+            insort(self._points, point)
+            self._owners[point] = node
+
+    def remove(self, node: str) -> None:
+        if node not in self.nodes:
+            return
+        self.nodes.remove(node)
+        for replica in range(self.replicas):
+            point = _get_point(f"{node}#{replica}")
+            self._points.remove(point)
+            del self._owners[point]
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Returns the node owning `key`, None if the ring is empty.
+        """
+        if not self._points:
+            return
+        index = bisect(self._points, _get_point(key)) % len(self._points)
+        return self._owners[self._points[index]]
@@ -0,0 +1,221 @@
+"""
+Retention of the state of a server: the history of the channels is
+trimmed according to limits (see `config.retention_max_age` and the
+following), and the channels and presence entries nobody uses anymore
+are removed.
+
+The work is done by the handler, by batches (see `ServerHandler.evict`),
+so that it is interleaved with the commands instead of delaying them.
+Each batch goes through a part of the tables only, resuming where the
+previous one stopped. `EvictionThread` only schedules it.
+"""
+
+from __future__ import annotations
+
+from heapq import heapify, heappop, heappush
+from itertools import islice
+from typing import TYPE_CHECKING, Iterator, Optional
+
+from .config import (
+    retention_max_age, retention_max_messages, retention_max_bytes,
+    retention_total_messages, retention_total_bytes, retention_channels,
+    presence_max_idle, retention_interval,
+)
+from .history import get_size
+from . import objects
+from .threads import BaseThread
+from ._utils import get_time
+
+if TYPE_CHECKING:
+    from ._server import OwnServer
+
+
+class RetentionPolicy:
+
+    """
+    Limits on the history of a channel, None meaning no limit.
+    """
+
+    def __init__(self,
+                 max_age: Optional[int] = retention_max_age,
+                 max_messages: Optional[int] = retention_max_messages,
+                 max_bytes: Optional[int] = retention_max_bytes):
+        self.max_age = max_age
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+
+    @classmethod
+    def of(cls, channel: str) -> RetentionPolicy:
+        """
+        Returns the policy of a channel: the global limits,
+        overridden by its own if it has some (see `config.retention_channels`).
+        """
+        return cls(**retention_channels.get(channel, {}))
+
+
+class Retention:
+
+    """
+    Removes what exceeds the retention limits of a server.
+    """
+
+    def __init__(self,
+                 server: OwnServer,
+                 total_messages: Optional[int] = retention_total_messages,
+                 total_bytes: Optional[int] = retention_total_bytes,
+                 max_idle: int = presence_max_idle):
+        self.server = server
+        self.total_messages = total_messages
+        self.total_bytes = total_bytes
+        self.max_idle = max_idle
+        # Number of objects removed, by kind
+        self.evicted = {"messages": 0, "channels": 0, "presence": 0}
+        # Identifiers of the documents left to go through, by table (see `_scan`)
+        self._cursors: dict[str, Iterator[int]] = {}
+
+    def evict(self, limit: int) -> int:
+        """
+        Removes at most `limit` objects exceeding the limits,
+        and returns how many were. If it is `limit`, there might be more.
+        """
+        now = get_time()
+        removed = self._evict_channels_history(now, limit)
+        removed += self._evict_history(limit - removed)
+        if removed < limit:
+            removed += self._evict_presence(now, limit - removed)
+        if removed < limit:
+            removed += self._evict_channels(limit - removed)
+        return removed
+
+    def _evict_channels_history(self, now: int, limit: int) -> int:
+        """
+        Enforces the limits of each channel.
+        """
+        history = self.server.history
+        removed = 0
+        for channel in history.channels:
+            if removed >= limit:
+                break
+            policy = RetentionPolicy.of(channel)
+            count = 0
+            if policy.max_age is not None:
+                count = history.count_since(channel, now - policy.max_age)
+            if policy.max_messages is not None:
+                count = max(count, history.count(channel) - policy.max_messages)
+            if policy.max_bytes is not None:
+                # Remove the oldest messages until the rest fits
+                excess = history.sizes[channel] - policy.max_bytes
+                oldest = 0
+                for message in history.get_oldest(channel, limit - removed):
+                    if excess <= 0:
+                        break
+                    excess -= get_size(message)
+                    oldest += 1
+                count = max(count, oldest)
+            count = min(count, limit - removed)
+            if count:
+                history.evict(channel, count)
+                removed += count
+        self.evicted["messages"] += removed
+        return removed
+
+    def _evict_history(self, limit: int) -> int:
+        """
+        Enforces the limits of all the channels together,
+        by removing the oldest messages of the network first.
+        """
+        history = self.server.history
+
+        def exceeds() -> bool:
+            return ((self.total_messages is not None and len(history) > self.total_messages)
+                    or (self.total_bytes is not None and history.size > self.total_bytes))
+
+        removed = 0
+        if not exceeds():
+            return removed
+        # The channels, by their oldest message
+        oldest = [(history.get_oldest(channel, 1)[0]["timestamp"], channel) for channel in history.channels]
+        heapify(oldest)
+        while removed < limit and oldest and exceeds():
+            _, channel = heappop(oldest)
+            history.evict(channel, 1)
+            removed += 1
+            if message := history.get_oldest(channel, 1):
+                heappush(oldest, (message[0]["timestamp"], channel))
+        self.evicted["messages"] += removed
+        return removed
+
+    def _scan(self, obj: type, count: int) -> Iterator[dict]:
+        """
+        Yields the next `count` documents of the table of `obj`,
+        continuing from where the previous call stopped.
+        Once the whole table was gone through, the next call starts over.
+        """
+        table = obj.__table_name__
+        if table not in self._cursors:
+            self._cursors[table] = iter(self.server.database.get_ids(obj))
+        identifiers = list(islice(self._cursors[table], count))
+        if len(identifiers) < count:
+            del self._cursors[table]
+        for identifier in identifiers:
+            # Unless it was removed since
+            if (document := self.server.database.get_by_id(obj, identifier)) is not None:
+                yield document
+
+    def _evict_presence(self, now: int, limit: int) -> int:
+        """
+        Forgets the users away for too long.
+        """
+        removed = 0
+        with self.server.database as db:
+            for document in self._scan(objects.AwayRegister, limit):
+                if now - document["since"] > self.max_idle:
+                    away_reg = objects.AwayRegister(**document)
+                    db.remove(away_reg)
+                    self.server.record(away_reg, removed=True)
+                    removed += 1
+        self.evicted["presence"] += removed
+        return removed
+
+    def _evict_channels(self, limit: int) -> int:
+        """
+        Removes the channels we host which have neither members nor history,
+        and the ones hosted by servers we don't know anymore.
+        """
+        removed = 0
+        with self.server.database as db:
+            for document in self._scan(objects.ServerChannel, limit):
+                if document["host"] == self.server.name:
+                    if (self.server.membership.count(document["name"])
+                            or self.server.history.count(document["name"])):
+                        continue
+                    chan = objects.ServerChannel(**document)
+                    db.remove(chan)
+                    self.server.membership.discard(chan.name)
+                    self.server.record(chan, removed=True)
+                elif self.server.get_peer(document["host"]) is None:
+                    db.remove(objects.ServerChannel(**document))
+                else:
+                    continue
+                removed += 1
+        self.evicted["channels"] += removed
+        return removed
+
+
+class EvictionThread(BaseThread):
+
+    """
+    Asks the handler of a server to enforce the retention limits,
+    every `interval` seconds.
+    """
+
+    def __init__(self, server: OwnServer, interval: float = retention_interval):
+        super().__init__()
+        self.server = server
+        self.interval = interval
+
+    def run(self):
+        while self.running:
+            if self._local_stop_event.wait(self.interval):
+                break
+            self.server.schedule("evict")
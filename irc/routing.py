@@ -0,0 +1,264 @@
+"""
+Liveness and latency of the links between servers, and the choice of
+the path to reach a server which is not (or not well) linked to us.
+
+Servers exchange heartbeats (`ping`, answered by `pong`) with their
+peers, from which they measure the round-trip time and the loss of each
+link. Heartbeats also carry the cost (in milliseconds) at which the
+sender reaches the other servers, so that each server knows, for every
+server of the network, which peer is on the cheapest path to it
+(distance-vector routing). A link which stops answering is considered
+failed, and the paths going through it are replaced.
+
+With workers (see `irc.workers`), the answer to a heartbeat can reach
+any worker of the server which sent it: heartbeats are tagged with the
+internal port of their sender, to which the others forward the answer.
+"""
+
+from __future__ import annotations
+
+import time
+import threading as th
+
+from collections import deque
+from json import JSONDecoder, JSONEncoder
+from typing import TYPE_CHECKING, Optional
+
+from .config import (
+    frame_separator, heartbeat_interval, heartbeat_timeout,
+    heartbeat_window, heartbeat_loss_penalty,
+)
+from . import objects
+from .threads import BaseThread
+
+if TYPE_CHECKING:
+    from ._server import OwnServer, Server
+
+
+class LinkState:
+
+    """
+    What we measured of the link to a peer.
+    """
+
+    def __init__(self):
+        self.rtt: Optional[float] = None  # Smoothed, in milliseconds
+        self.last_seen = time.monotonic()
+        # Heartbeats waiting for an answer, by sequence number, and when they were sent
+        self.pending: dict[str, float] = {}
+        # Whether each of the last heartbeats was answered
+        self.outcomes: deque[bool] = deque(maxlen=heartbeat_window)
+        # Cost at which the peer reaches the other servers
+        self.routes: dict[str, float] = {}
+
+    @property
+    def loss(self) -> float:
+        """
+        Proportion of the last heartbeats which were not answered.
+        """
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    def is_alive(self, now: float) -> bool:
+        return self.rtt is not None and now - self.last_seen < heartbeat_timeout
+
+    def get_cost(self, now: float) -> float:
+        """
+        Cost of sending something over this link: its latency,
+        increased by its loss, as lost commands are sent again.
+        """
+        if not self.is_alive(now):
+            return float("inf")
+        return self.rtt * (1 + heartbeat_loss_penalty * self.loss)
+
+
+class Router:
+
+    """
+    Keeps track of the links to the peers of a server, and of the paths
+    to the other servers of the network.
+    """
+
+    def __init__(self, server: OwnServer):
+        self.server = server
+        self.links: dict[str, LinkState] = {}
+        # Cost and next hop of the cheapest path to each server
+        self.table: dict[str, tuple[float, str]] = {}
+        # Peers which answered, and then stopped: they are considered dead
+        self.failed: set[str] = set()
+        self._sequence = 0
+        self._lock = th.Lock()
+
+    def get_next_hop(self, name: str) -> Optional[Server]:
+        """
+        Returns the peer to send something addressed to the server `name`
+        to, or None if we know no path to it.
+        """
+        route = self.table.get(name)
+        if route is None:
+            return
+        return self.server.get_peer(route[1])
+
+    def _update(self) -> None:
+        """
+        Recomputes the cheapest path to each server.
+        Must be called with the lock held.
+        """
+        now = time.monotonic()
+        table = {}
+        for peer, link in self.links.items():
+            cost = link.get_cost(now)
+            if cost == float("inf"):
+                continue
+            candidates = {peer: 0.0, **link.routes}
+            for destination, remaining in candidates.items():
+                if destination == self.server.name:
+                    continue
+                total = cost + remaining
+                if destination not in table or total < table[destination][0]:
+                    table[destination] = (total, peer)
+        self.table = table
+
+    def _advertise(self, peer: str) -> str:
+        """
+        Returns the routes we advertise to `peer`. The ones going
+        through it are left out (split horizon), so that it does not
+        think it can reach a server through us when we go through it.
+        """
+        return JSONEncoder().encode({
+            destination: cost
+            for destination, (cost, next_hop) in self.table.items()
+            if next_hop != peer and destination != peer
+        })
+
+    def _get_sequence(self) -> str:
+        """
+        Returns the sequence number of a new heartbeat,
+        tagged with our internal port if we are a worker.
+        """
+        self._sequence += 1
+        if self.server.internal is None:
+            return str(self._sequence)
+        return f"{self._sequence}@{self.server.internal.port}"
+
+    def _get_heartbeat(self, identifier: str, peer: str, sequence: str, sent: str) -> bytes:
+        return repr(objects.Command(
+            author=self.server.name,
+            recipient=peer,
+            identifier=identifier,
+            parameters={
+                "sequence": sequence,
+                "sent": sent,
+                "routes": self._advertise(peer),
+            },
+        )).encode() + frame_separator
+
+    def ping(self) -> None:
+        """
+        Sends a heartbeat to each peer, and accounts for the ones
+        which were not answered in time.
+        """
+        now = time.monotonic()
+        heartbeats = []
+        failed = []
+        with self._lock:
+            for peer in self.server.peers:
+                link = self.links.setdefault(peer.name, LinkState())
+                for sequence, sent in list(link.pending.items()):
+                    if now - sent > heartbeat_timeout:
+                        del link.pending[sequence]
+                        link.outcomes.append(False)
+                if link.rtt is not None and not link.is_alive(now) and peer.name not in self.failed:
+                    self.failed.add(peer.name)
+                    failed.append(peer)
+                sequence = self._get_sequence()
+                link.pending[sequence] = now
+                heartbeats.append((peer, self._get_heartbeat(
+                    "ping", peer.name, sequence, str(time.monotonic_ns()),
+                )))
+            self._update()
+        for peer in failed:
+            self.server.on_peer_failed(peer)
+        for peer, heartbeat in heartbeats:
+            # Not delayed by batching, which would add to the measure
+            self.server._send(heartbeat, peer, urgent=True)
+
+    def receive(self, identifier: str, author: str, parameters: dict[str, str]) -> None:
+        """
+        Handles a heartbeat (`ping`), or the answer to one of ours (`pong`).
+        """
+        peer = self.server.get_peer(author)
+        if peer is None:
+            return
+        if identifier == "pong" and (sibling := self._get_sender(parameters["sequence"])) is not None:
+            # The answer to a heartbeat of a sibling worker
+            self.server._send(repr(objects.Command(
+                author=author,
+                recipient=self.server.name,
+                identifier=identifier,
+                parameters=parameters,
+            )).encode() + frame_separator, sibling, urgent=True)
+            return
+        routes = JSONDecoder().decode(parameters["routes"])
+        with self._lock:
+            link = self.links.setdefault(author, LinkState())
+            link.routes = routes
+            if identifier == "pong":
+                if link.pending.pop(parameters["sequence"], None) is None:
+                    # Answered too late, already counted as lost
+                    return
+                back = author in self.failed
+                self.failed.discard(author)
+                rtt = (time.monotonic_ns() - int(parameters["sent"])) / 1e6
+                link.rtt = rtt if link.rtt is None else 0.8 * link.rtt + 0.2 * rtt
+                link.last_seen = time.monotonic()
+                link.outcomes.append(True)
+                self._update()
+            else:
+                answer = self._get_heartbeat("pong", author, parameters["sequence"], parameters["sent"])
+        if identifier == "ping":
+            self.server._send(answer, peer, urgent=True)
+        elif back:
+            self.server.on_peer_back(peer)
+
+    def _get_sender(self, sequence: str) -> Optional[Server]:
+        """
+        Returns the sibling worker which sent the heartbeat `sequence`,
+        None if we did.
+        """
+        _, _, port = sequence.partition("@")
+        if self.server.internal is None or not port.isdigit() or int(port) == self.server.internal.port:
+            return
+        for sibling in self.server.siblings:
+            if sibling.port == int(port):
+                return sibling
+
+    def get_stats(self) -> dict[str, dict[str, float | bool | None]]:
+        """
+        Returns the round-trip time, loss and liveness of each link.
+        """
+        now = time.monotonic()
+        with self._lock:
+            return {
+                peer: {"rtt": link.rtt, "loss": link.loss, "alive": link.is_alive(now)}
+                for peer, link in self.links.items()
+            }
+
+
+class HeartbeatThread(BaseThread):
+
+    """
+    Sends heartbeats to the peers of a server every `interval` seconds.
+    """
+
+    def __init__(self, server: OwnServer, interval: float = heartbeat_interval):
+        super().__init__()
+        self.server = server
+        self.interval = interval
+
+    def run(self):
+        while self.running:
+            self.server.routing.ping()
+            if self._local_stop_event.wait(self.interval):
+                break
@@ -0,0 +1,113 @@
+"""
+Full-text search over the history of the channels.
+"""
+
+from __future__ import annotations
+
+import re
+
+from bisect import bisect_left
+from typing import Iterator
+
+from .config import search_page_size
+
+
+_token_pattern = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> set[str]:
+    """
+    Returns the distinct words of `text`, lowercased.
+
+    Examples
+    --------
+    >>> sorted(tokenize("Hello, hello World!"))
+    ['hello', 'world']
+    """
+    return set(_token_pattern.findall(text.lower()))
+
+
+class SearchIndex:
+
+    """
+    Inverted index of messages: for each channel and word, the list of
+    the messages containing it (their posting list).
+
+    Messages are numbered as they are added, so posting lists are
+    sorted, and appended to (messages are removed from them when they
+    are evicted, see `irc.retention`). Finding the messages containing
+    all the words of a query walks the shortest posting list from its
+    end (the most recent messages first), and looks each message up in
+    the others by binary search.
+    """
+
+    def __init__(self):
+        self._messages: dict[int, dict] = {}
+        self._postings: dict[tuple[str, str], list[int]] = {}
+        self._next = 0  # Number of the next message
+
+    def add(self, message: dict) -> int:
+        """
+        Indexes a message (see `objects.Message`), and returns its number.
+        """
+        number = self._next
+        self._next += 1
+        self._messages[number] = message
+        for token in tokenize(message["content"]):
+            self._postings.setdefault((message["channel"], token), []).append(number)
+        return number
+
+    def remove(self, number: int) -> None:
+        """
+        Removes a message from the index.
+        """
+        message = self._messages.pop(number)
+        for token in tokenize(message["content"]):
+            key = (message["channel"], token)
+            posting = self._postings[key]
+            del posting[bisect_left(posting, number)]
+            if not posting:
+                del self._postings[key]
+
+    def _match(self, channel: str, tokens: set[str]) -> Iterator[dict]:
+        postings = sorted(
+            (self._postings.get((channel, token), []) for token in tokens),
+            key=len,
+        )
+        shortest, others = postings[0], postings[1:]
+        for number in reversed(shortest):
+            for posting in others:
+                position = bisect_left(posting, number)
+                if position == len(posting) or posting[position] != number:
+                    break
+            else:
+                yield self._messages[number]
+
+    def search(self, channel: str, terms: str, page: int = 0, page_size: int = search_page_size) -> list[dict]:
+        """
+        Returns the messages of `channel` containing all the words of
+        `terms`, most recent first, by pages of `page_size`.
+
+        Examples
+        --------
+        >>> index = SearchIndex()
+        >>> for i, content in enumerate(["Hello world", "hello there", "world peace", "Hello, world!"]):
+        ...     _ = index.add({"channel": "#a", "author": "alice", "content": content, "timestamp": i})
+        >>> [message["content"] for message in index.search("#a", "hello world")]
+        ['Hello, world!', 'Hello world']
+        >>> [message["content"] for message in index.search("#a", "hello", page=1, page_size=2)]
+        ['Hello world']
+        """
+        tokens = tokenize(terms)
+        if not tokens:
+            return []
+        results = []
+        skip = page * page_size
+        for message in self._match(channel, tokens):
+            if skip:
+                skip -= 1
+                continue
+            results.append(message)
+            if len(results) == page_size:
+                break
+        return results
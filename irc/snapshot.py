@@ -0,0 +1,50 @@
+"""
+Snapshots of a server state, written when it stops,
+and loaded when it starts again.
+"""
+
+from __future__ import annotations
+
+import os
+import mmap
+import pickle
+
+from pathlib import Path
+from typing import Any, Optional
+
+
+# Incremented when the content of the snapshots changes
+snapshot_format = 3
+
+
+def save(path: Path, state: dict[str, Any]) -> None:
+    """
+    Writes `state`, made of builtin types, to `path`.
+    The file is replaced atomically, so a crash while writing it
+    leaves the previous snapshot intact.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_suffix(f"{path.suffix}.tmp")
+    with temporary.open("wb") as file:
+        pickle.dump(
+            {"format": snapshot_format, "state": state},
+            file,
+            protocol=pickle.HIGHEST_PROTOCOL,
+        )
+    os.replace(temporary, path)
+
+
+def load(path: Path) -> Optional[dict[str, Any]]:
+    """
+    Reads the state written at `path`.
+    Returns None if there is none, or if it was written in another format.
+    The file is memory-mapped rather than read.
+    """
+    if not path.is_file() or not path.stat().st_size:
+        return
+    with path.open("rb") as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as content:
+            snapshot = pickle.loads(content)
+    if snapshot.get("format") != snapshot_format:
+        return
+    return snapshot["state"]
@@ -0,0 +1,241 @@
+"""
+Compact in-memory representation of who is in which channel.
+
+Nicknames and channel names are interned into small integers by a
+`SymbolTable`. The members of each channel, and the channels of each
+user, are then stored as sorted arrays of those integers, rather than
+lists of strings. Strings are only looked up again when talking to the
+outside (the network, the snapshot).
+"""
+
+from __future__ import annotations
+
+import sys
+
+from array import array
+from bisect import bisect_left
+from typing import Iterator
+
+
+class SymbolTable:
+
+    """
+    Maps strings to small integer identifiers, and back.
+    Each call to `intern` takes a reference to the string, given back
+    with `release`: once its last reference is, its identifier is freed,
+    and given to the next string interned.
+
+    Examples
+    --------
+    >>> symbols = SymbolTable()
+    >>> symbols.intern("alice"), symbols.intern("bob"), symbols.intern("alice")
+    (0, 1, 0)
+    >>> symbols.resolve(1)
+    'bob'
+    >>> symbols.get("carol") is None
+    True
+    >>> symbols.release(0); symbols.release(0)
+    >>> symbols.get("alice") is None, symbols.intern("carol")
+    (True, 0)
+    """
+
+    def __init__(self):
+        self._ids: dict[str, int] = {}
+        self._names: list[str | None] = []
+        self._references: list[int] = []  # By identifier
+        self._free: list[int] = []  # Identifiers freed, to be reused
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def intern(self, name: str) -> int:
+        """
+        Returns the identifier of `name`, assigning it one if it has none,
+        and takes a reference to it.
+        """
+        identifier = self._ids.get(name)
+        if identifier is None:
+            name = sys.intern(name)
+            if self._free:
+                identifier = self._free.pop()
+                self._names[identifier] = name
+            else:
+                identifier = len(self._names)
+                self._names.append(name)
+                self._references.append(0)
+            self._ids[name] = identifier
+        self._references[identifier] += 1
+        return identifier
+
+    def release(self, identifier: int) -> None:
+        """
+        Gives back a reference taken by `intern`.
+        """
+        self._references[identifier] -= 1
+        if not self._references[identifier]:
+            del self._ids[self._names[identifier]]
+            self._names[identifier] = None
+            self._free.append(identifier)
+
+    def get(self, name: str) -> int | None:
+        return self._ids.get(name)
+
+    def resolve(self, identifier: int) -> str:
+        return self._names[identifier]
+
+    def get_size(self) -> int:
+        """
+        Returns the memory used by the table, in bytes.
+        """
+        return (
+            sys.getsizeof(self._ids)
+            + sys.getsizeof(self._names)
+            + sys.getsizeof(self._references)
+            + sys.getsizeof(self._free)
+            + sum(sys.getsizeof(name) for name in self._names if name is not None)
+        )
+
+
+def _insert(values: array, value: int) -> bool:
+    position = bisect_left(values, value)
+    if position < len(values) and values[position] == value:
+        return False
+    values.insert(position, value)
+    return True
+
+
+def _remove(values: array, value: int) -> bool:
+    position = bisect_left(values, value)
+    if position == len(values) or values[position] != value:
+        return False
+    del values[position]
+    return True
+
+
+class Membership:
+
+    """
+    Members of the channels, and channels of the users,
+    as sorted arrays of identifiers.
+    A channel holds a reference to its name in the symbol table,
+    and a user to theirs, as long as they are in a channel.
+
+    Examples
+    --------
+    >>> membership = Membership()
+    >>> membership.set("#a", ["alice", "bob"])
+    >>> membership.add("#b", "alice")
+    True
+    >>> list(membership.get_members("#a")), membership.is_member("#b", "bob")
+    (['alice', 'bob'], False)
+    >>> sorted(membership.get_channels("alice"))
+    ['#a', '#b']
+    >>> membership.discard("#a")
+    >>> membership.dump(), len(membership.symbols)
+    ({'#b': ['alice']}, 2)
+    """
+
+    def __init__(self, symbols: SymbolTable | None = None):
+        self.symbols = symbols or SymbolTable()
+        self._members: dict[int, array] = {}  # By channel
+        self._channels: dict[int, array] = {}  # By user
+
+    def has_channel(self, channel: str) -> bool:
+        identifier = self.symbols.get(channel)
+        return identifier is not None and identifier in self._members
+
+    def add(self, channel: str, nickname: str) -> bool:
+        """
+        Adds a user to a channel, creating it if needed.
+        Returns whether they were not already a member.
+        """
+        channel_id = self.symbols.get(channel)
+        if channel_id is None or channel_id not in self._members:
+            channel_id = self.symbols.intern(channel)
+            self._members[channel_id] = array("I")
+        user_id = self.symbols.get(nickname)
+        if user_id is None or user_id not in self._channels:
+            user_id = self.symbols.intern(nickname)
+            self._channels[user_id] = array("I")
+        if not _insert(self._members[channel_id], user_id):
+            return False
+        _insert(self._channels[user_id], channel_id)
+        return True
+
+    def set(self, channel: str, members: list[str]) -> None:
+        """
+        Sets the members of a channel, creating it if needed.
+        """
+        self.discard(channel)
+        self._members[self.symbols.intern(channel)] = array("I")
+        for nickname in members:
+            self.add(channel, nickname)
+
+    def discard(self, channel: str) -> None:
+        """
+        Forgets a channel, if we know it.
+        """
+        channel_id = self.symbols.get(channel)
+        if channel_id is None or channel_id not in self._members:
+            return
+        for user_id in self._members.pop(channel_id):
+            channels = self._channels[user_id]
+            _remove(channels, channel_id)
+            if not channels:
+                del self._channels[user_id]
+                self.symbols.release(user_id)
+        self.symbols.release(channel_id)
+
+    def is_member(self, channel: str, nickname: str) -> bool:
+        channel_id, user_id = self.symbols.get(channel), self.symbols.get(nickname)
+        if channel_id is None or user_id is None:
+            return False
+        members = self._members.get(channel_id)
+        if members is None:
+            return False
+        position = bisect_left(members, user_id)
+        return position < len(members) and members[position] == user_id
+
+    def get_members(self, channel: str) -> Iterator[str]:
+        channel_id = self.symbols.get(channel)
+        for user_id in self._members.get(channel_id, ()):
+            yield self.symbols.resolve(user_id)
+
+    def count(self, channel: str) -> int:
+        return len(self._members.get(self.symbols.get(channel), ()))
+
+    def dump(self) -> dict[str, list[str]]:
+        """
+        Returns the members of each channel, by name.
+        """
+        return {
+            self.symbols.resolve(channel_id): [self.symbols.resolve(user_id) for user_id in members]
+            for channel_id, members in self._members.items()
+        }
+
+    def get_channels(self, nickname: str) -> Iterator[str]:
+        user_id = self.symbols.get(nickname)
+        for channel_id in self._channels.get(user_id, ()):
+            yield self.symbols.resolve(channel_id)
+
+    def get_memory_report(self) -> dict[str, float]:
+        """
+        Returns the number of users, channels and memberships,
+        and the memory they use, in bytes.
+        """
+        users = len(self._channels)
+        memberships = sum(map(len, self._members.values()))
+        membership_size = sum(
+            sys.getsizeof(mapping) + sum(map(sys.getsizeof, mapping.values()))
+            for mapping in (self._members, self._channels)
+        )
+        symbols_size = self.symbols.get_size()
+        return {
+            "users": users,
+            "channels": len(self._members),
+            "memberships": memberships,
+            "symbols_bytes": symbols_size,
+            "membership_bytes": membership_size,
+            "bytes_per_user": symbols_size / users if users else 0,
+            "bytes_per_membership": membership_size / memberships if memberships else 0,
+        }
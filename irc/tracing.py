@@ -0,0 +1,93 @@
+"""
+Tracing of the commands through the network.
+
+A traced command carries, after its timestamp, a trace id and the hops it
+went through, each being the node (server name or nickname), the stage
+(e.g. `enqueue`, `dispatch`, `send`), and the time in nanoseconds:
+
+`command:<author>:<recipient>:<command>:<parameters>:<timestamp>;<trace id>;<node>/<stage>@<time>,...`
+
+Parsers unaware of tracing ignore it along with the timestamp.
+"""
+
+from __future__ import annotations
+
+import random
+import threading as th
+
+from uuid import uuid4
+from json import JSONEncoder
+
+from .config import trace_sample_rate, trace_file
+from ._utils import get_time_ns
+
+
+_lock = th.Lock()
+
+
+def format_trace(trace_id: str, hops: list[str]) -> str:
+    """
+    Returns what is appended to the timestamp of a command,
+    empty if it is not traced.
+    """
+    if not trace_id:
+        return ""
+    return f";{trace_id};{','.join(hops)}"
+
+
+def parse_trace(timestamp: str) -> tuple[int, str, list[str]]:
+    """
+    Takes the timestamp section of a command,
+    and returns the timestamp, the trace id and the hops.
+
+    Examples
+    --------
+    >>> parse_trace("1700000000")
+    (1700000000, '', [])
+    >>> parse_trace("1700000000;8f3a;alice/client_send@1700000000000000000")
+    (1700000000, '8f3a', ['alice/client_send@1700000000000000000'])
+    """
+    timestamp, _, trace = timestamp.partition(";")
+    if not trace:
+        return int(timestamp), "", []
+    trace_id, _, hops = trace.partition(";")
+    return int(timestamp), trace_id, hops.split(",") if hops else []
+
+
+def get_hop(node: str, stage: str) -> str:
+    return f"{node}/{stage}@{get_time_ns()}"
+
+
+def sample() -> str:
+    """
+    Returns a new trace id if this command should be traced,
+    an empty string otherwise.
+    """
+    if trace_sample_rate and random.random() < trace_sample_rate:
+        return uuid4().hex[:16]
+    return ""
+
+
+def add_hop(raw_command: bytes, node: str, stage: str) -> bytes:
+    """
+    Adds a hop to a command which is not parsed yet.
+    If it is not traced, it might be sampled.
+    """
+    _, _, timestamp = raw_command.rpartition(b":")
+    if b";" in timestamp:
+        return raw_command + b"," + get_hop(node, stage).encode()
+    if trace_id := sample():
+        return raw_command + f";{trace_id};{get_hop(node, stage)}".encode()
+    return raw_command
+
+
+def write(trace_id: str, hops: list[str]) -> None:
+    """
+    Appends the hops of a trace to the trace file.
+    Several records can exist for the same trace:
+    each node writes the hops it knows of.
+    """
+    line = JSONEncoder().encode({"trace": trace_id, "hops": hops}) + "\n"
+    with _lock:
+        with trace_file.open("a") as file:
+            file.write(line)
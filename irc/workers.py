@@ -0,0 +1,94 @@
+"""
+Multi-process mode of the server.
+
+Several worker processes listen on the same port (`SO_REUSEPORT`),
+and the kernel spreads the incoming connections among them.
+They present themselves to the other servers under the same name,
+and keep their states consistent by replicating the commands changing it
+to each other, over an internal port each (see `ServerHandler.replicate`).
+The commands for clients connected to a sibling are only pushed to it
+(see `OwnServer.deliver_to_siblings`).
+"""
+
+from __future__ import annotations
+
+import socket
+import multiprocessing as mp
+
+from ._server import OwnServer, Server
+
+
+def get_free_ports(count: int) -> list[int]:
+    """
+    Returns `count` ports currently available on localhost.
+    """
+    sockets = [socket.socket() for _ in range(count)]
+    try:
+        for sock in sockets:
+            sock.bind(("localhost", 0))
+        return [sock.getsockname()[1] for sock in sockets]
+    finally:
+        for sock in sockets:
+            sock.close()
+
+
+def _run_worker(
+    port: int,
+    worker: int,
+    internal_ports: list[int],
+    peers: list[str],
+    options: dict,
+    stop_event: mp.Event,
+) -> None:
+    server = OwnServer("localhost", port, worker=worker, **options)
+    server.internal = Server("localhost", internal_ports[worker])
+    server.siblings = [
+        Server("localhost", internal_port)
+        for i, internal_port in enumerate(internal_ports)
+        if i != worker
+    ]
+    server.listen()
+    server.sync(*map(Server.from_name, peers))
+    stop_event.wait()
+    server.close()
+
+
+class Workers:
+
+    """
+    A server made of `count` worker processes sharing the same port.
+    Exposes the same interface as `OwnServer` to the command line.
+    `options` are passed to the `OwnServer` of each worker.
+    """
+
+    def __init__(self, name: str, peers: list[str], count: int, **options):
+        if not hasattr(socket, "SO_REUSEPORT"):
+            raise RuntimeError("Workers require SO_REUSEPORT, which this platform does not support.")
+        self.port = int(name)
+        self.peers = list(peers)
+        self.count = count
+        self.options = options
+        # Workers are forked, so that they can be started
+        # without re-importing the entry point.
+        self._context = mp.get_context("fork")
+        self._stop_event = self._context.Event()
+        self._processes: list[mp.Process] = []
+
+    def listen(self) -> None:
+        internal_ports = get_free_ports(self.count)
+        for worker in range(self.count):
+            process = self._context.Process(
+                target=_run_worker,
+                name=f"worker-{worker}",
+                args=(self.port, worker, internal_ports, self.peers, self.options, self._stop_event),
+                daemon=True,
+            )
+            process.start()
+            self._processes.append(process)
+
+    def close(self) -> None:
+        self._stop_event.set()
+        for process in self._processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
@@ -1,23 +1,78 @@
 import click
-from colorama import Fore
-from colorama import init as colorama_init
-from art import text2art
 
-from irc import OwnServer
+from pathlib import Path
+from typing import Optional
 
-colorama_init(autoreset=True)
+
+def memory_console(server, arguments: list[str]) -> None:
+    """
+    Handles the `memory` commands of the console:
+    `memory` prints the gauges, `memory start` starts tracing the
+    allocations and recording the gauges, `memory snapshot` breaks the
+    allocations down by subsystem, `memory diff` compares the last two
+    snapshots, and `memory stop` stops.
+    """
+    action = arguments[0] if arguments else "gauges"
+    memory = server.memory
+    try:
+        if action == "gauges":
+            for key, value in memory.get_gauges().items():
+                click.echo(f"{key:<32}{value:>16,.1f}")
+        elif action == "start":
+            memory.start()
+            click.echo(f"Tracing allocations, gauges recorded to {memory.path}")
+        elif action == "stop":
+            memory.stop()
+            click.echo("Stopped tracing allocations.")
+        elif action == "snapshot":
+            click.echo(f"{'subsystem':<16}{'bytes':>16}{'blocks':>12}")
+            for subsystem, (size, count) in memory.snapshot().items():
+                click.echo(f"{subsystem:<16}{size:>16,}{count:>12,}")
+        elif action == "diff":
+            growth, places = memory.diff()
+            for subsystem, size in growth.items():
+                click.echo(f"{subsystem:<16}{size:>+16,}")
+            for subsystem, place, size, count in places:
+                click.echo(f"{size:>+12,} B{count:>+10,}  [{subsystem}] {place}")
+        else:
+            click.echo("Usage: memory [start|snapshot|diff|stop]")
+    except RuntimeError as error:
+        click.echo(str(error))
 
 
 @click.command()
 @click.argument("server_name", type=int, nargs=1)
-@click.argument("servers", type=list[str], nargs=-1)
-def run_server(server_name: str, servers: list[str]):
+@click.argument("servers", type=str, nargs=-1)
+@click.option("--in-memory", is_flag=True, default=False,
+              help="Do not store the server state on disk.")
+@click.option("--workers", type=int, default=1,
+              help="Number of processes sharing the port, to use several cores.")
+@click.option("--placement", type=click.Choice(["origin", "consistent"]), default="origin",
+              help="How the host of a channel is chosen.")
+@click.option("--capture", type=click.Path(dir_okay=False, path_type=Path), default=None,
+              help="File to capture the traffic to, to replay it with `python -m tools.replay`.")
+@click.option("--no-banner", is_flag=True, default=False,
+              help="Do not clear the terminal to print the banner.")
+def run_server(server_name: str, servers: list[str], in_memory: bool, workers: int, placement: str,
+               capture: Optional[Path], no_banner: bool):
+    # Imported once the command line is parsed, so that `--help` is fast
+    from irc import OwnServer, Server
+    from irc.workers import Workers
+    from irc._utils import print_banner
+
     click.echo(f"Launching server on hostname:{server_name}...")
-    server = OwnServer.from_name(server_name)
-    server.sync(*servers)
+    if workers > 1:
+        if capture is not None:
+            raise click.BadParameter("Capture is not supported with several workers.", param_hint="--capture")
+        server = Workers(server_name, servers, workers, in_memory=in_memory, placement=placement)
+    else:
+        server = OwnServer.from_name(server_name, in_memory=in_memory, placement=placement, capture=capture)
     server.listen()
-    click.clear()
-    click.echo(f"{Fore.LIGHTBLUE_EX}{text2art('IRC server', font='random')}")
+    if workers <= 1:
+        # Once we listen, so that we receive their state
+        server.sync(*map(Server.from_name, servers))
+    if not no_banner:
+        print_banner("IRC server")
     while True:
         try:
             command = click.prompt("", type=str, prompt_suffix="").lower()
@@ -26,6 +81,11 @@ def run_server(server_name: str, servers: list[str]):
         if command in ["exit", "quit", "q"]:
             click.echo("Exiting!")
             break
+        elif command.split()[:1] == ["memory"]:
+            if workers > 1:
+                click.echo("The workers run in their own processes.")
+                continue
+            memory_console(server, command.split()[1:])
     server.close()
 
 
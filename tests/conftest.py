@@ -0,0 +1,44 @@
+import time
+import socket
+
+import pytest
+
+from irc.config import frame_separator
+
+
+def _wait_for(condition, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def _read_frames(connection, timeout):
+    connection.settimeout(timeout)
+    content = bytes()
+    try:
+        while part := connection.recv(4096):
+            content += part
+    except socket.timeout:
+        pass
+    return [frame.decode() for frame in content.split(frame_separator) if frame]
+
+
+@pytest.fixture
+def wait_for():
+    """
+    Waits until `condition()` is true, and returns whether it was
+    within `timeout` seconds: `wait_for(condition, timeout)`.
+    """
+    return _wait_for
+
+
+@pytest.fixture
+def read_frames():
+    """
+    Reads the frames pushed on `connection` until none came
+    for `timeout` seconds: `read_frames(connection, timeout)`.
+    """
+    return _read_frames
@@ -0,0 +1,43 @@
+from irc.cluster import Cluster, submit
+from irc.objects import Command, ServerChannel
+from irc.workers import get_free_ports
+
+
+def get_hosts(server):
+    return {document["name"]: document["host"] for document in server.database.get_all(ServerChannel)}
+
+
+def test_servers_are_linked_following_the_topology():
+    ports = get_free_ports(5)
+    with Cluster(ports, topology="ring") as cluster:
+        assert {peer.name for peer in cluster[0].peers} == {str(ports[1]), str(ports[4])}
+        assert {peer.name for peer in cluster[2].peers} == {str(ports[1]), str(ports[3])}
+
+
+def test_channels_are_taken_over_when_a_server_leaves(wait_for):
+    channels = [f"#channel{i}" for i in range(20)]
+    with Cluster(get_free_ports(3), placement="consistent") as cluster:
+        for channel in channels:
+            submit(cluster[0], Command(
+                author="alice",
+                recipient=cluster[0].name,
+                identifier="join",
+                parameters={"channel": channel, "key": "", "host": ""},
+            ))
+        assert wait_for(lambda: all(len(get_hosts(server)) == len(channels) for server in cluster.servers), 10)
+        leaving = cluster[2]
+        hosted = [channel for channel, host in get_hosts(cluster[0]).items() if host == leaving.name]
+        assert hosted
+
+        cluster.servers.remove(leaving)
+        leaving.close()
+        # Once its heartbeats time out, the others take its channels over
+        names = {server.name for server in cluster.servers}
+        assert wait_for(lambda: all(
+            set(get_hosts(server).values()) <= names for server in cluster.servers
+        ), 10)
+        for channel in hosted:
+            host = get_hosts(cluster[0])[channel]
+            assert get_hosts(cluster[1])[channel] == host
+            assert next(server for server in cluster.servers if server.name == host).membership.has_channel(channel)
+        assert all(leaving.name not in server.ring.nodes for server in cluster.servers)
@@ -0,0 +1,61 @@
+import threading as th
+
+from irc.database import Database
+from irc.objects import ServerChannel, User
+
+
+def test_concurrent_writes_are_kept(tmp_path):
+    database = Database(tmp_path / "database.tinydb")
+    writes = 100
+    errors = []
+    done = th.Event()
+
+    def write_channels(writer):
+        database.bind()
+        try:
+            for i in range(writes):
+                database.upsert(ServerChannel(name=f"#{writer}-{i}", host="6667", key=str(i)))
+        except Exception as error:
+            errors.append(error)
+
+    def write_users():
+        database.bind()
+        try:
+            for i in range(writes):
+                database.upsert(User(name=f"user-{i}", host="6667"))
+        except Exception as error:
+            errors.append(error)
+
+    def read():
+        database.bind()
+        # What a reader saw can't disappear, and each document is whole
+        seen = {ServerChannel: 0, User: 0}
+        try:
+            while not done.is_set():
+                for obj in seen:
+                    documents = database.get_all(obj)
+                    assert len(documents) >= seen[obj]
+                    seen[obj] = len(documents)
+                    for document in documents:
+                        obj(**document)
+        except Exception as error:
+            errors.append(error)
+
+    writers = [th.Thread(target=write_channels, args=(writer, )) for writer in range(3)]
+    writers.append(th.Thread(target=write_users))
+    readers = [th.Thread(target=read) for _ in range(4)]
+    for thread in (*readers, *writers):
+        thread.start()
+    for thread in writers:
+        thread.join()
+    done.set()
+    for thread in readers:
+        thread.join()
+
+    assert not errors
+    assert len(database.get_all(ServerChannel)) == 3 * writes
+    assert len(database.get_all(User)) == writes
+    # Nothing was lost on the storage either
+    reopened = Database(tmp_path / "database.tinydb")
+    assert len(reopened.get_all(ServerChannel)) == 3 * writes
+    assert len(reopened.get_all(User)) == writes
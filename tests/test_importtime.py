@@ -0,0 +1,15 @@
+import pytest
+
+from tools.importtime import get_start_time, targets
+
+
+@pytest.fixture(scope="module")
+def baseline():
+    return get_start_time(["-c", "pass"], runs=5)
+
+
+@pytest.mark.parametrize("name", list(targets))
+def test_start_time_is_within_budget(name, baseline):
+    arguments, budget = targets[name]
+    elapsed = get_start_time(arguments, runs=5) - baseline
+    assert elapsed <= budget, f"{name} took {elapsed:.1f} ms, over its budget of {budget} ms"
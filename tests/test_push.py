@@ -0,0 +1,28 @@
+import time
+import socket
+
+from irc.cluster import Cluster, submit
+from irc.config import frame_separator
+from irc.objects import Command
+from irc.workers import get_free_ports
+
+
+def test_commands_reach_clients_connected_to_another_server(read_frames):
+    with Cluster(get_free_ports(2)) as cluster:
+        a, b = cluster.servers
+        # bob has a persistent connection to b
+        with socket.create_connection((b.address, b.port)) as bob:
+            bob.sendall(repr(Command(author="bob", recipient="", identifier="hello", parameters={})).encode()
+                        + frame_separator)
+            submit(a, Command(author="alice", recipient=a.name, identifier="join",
+                              parameters={"channel": "#a", "key": "", "host": ""}))
+            time.sleep(0.5)
+            submit(b, Command(author="bob", recipient=b.name, identifier="join",
+                              parameters={"channel": "#a", "key": "", "host": ""}))
+            time.sleep(0.5)
+            # A private message, and a message to a channel hosted by a
+            submit(a, Command(author="alice", recipient="bob", identifier="msg", parameters={"content": "hi bob"}))
+            submit(a, Command(author="alice", recipient="#a", identifier="msg", parameters={"content": "hi all"}))
+            frames = read_frames(bob, timeout=2)
+        assert any(':bob:msg:{"content": "hi bob"}' in frame for frame in frames)
+        assert any(':#a:msg:{"content": "hi all"}' in frame for frame in frames)
@@ -0,0 +1,34 @@
+import time
+import socket
+
+import pytest
+
+from irc._server import OwnServer, Server
+from irc.config import heartbeat_timeout
+from irc.workers import get_free_ports
+
+
+@pytest.mark.skipif(not hasattr(socket, "SO_REUSEPORT"), reason="Workers require SO_REUSEPORT")
+def test_workers_see_their_peers_alive():
+    # Workers of the same server, living in this process
+    port, peer_port, *internal_ports = get_free_ports(4)
+    workers = []
+    for worker, internal_port in enumerate(internal_ports):
+        server = OwnServer("localhost", port, worker=worker, in_memory=True)
+        server.internal = Server("localhost", internal_port)
+        server.siblings = [Server("localhost", port) for port in internal_ports if port != internal_port]
+        workers.append(server)
+    peer = OwnServer("localhost", peer_port, in_memory=True)
+    for server in (*workers, peer):
+        server.listen()
+    try:
+        for server in workers:
+            server.sync(peer)
+        peer.sync(Server("localhost", port))
+        # Long enough for the heartbeats of a worker which got no answer to time out
+        time.sleep(heartbeat_timeout + 2)
+        for server in workers:
+            assert server.routing.get_stats()[peer.name]["alive"]
+    finally:
+        for server in (*workers, peer):
+            server.close()
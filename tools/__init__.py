@@ -0,0 +1,4 @@
+"""
+Command-line tools to measure and debug the network.
+Run them from the root of the repository, e.g. `python -m tools.traces --help`.
+"""
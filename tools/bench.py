@@ -0,0 +1,203 @@
+"""
+Micro-benchmarks of the primitives the network is made of: encoding and
+parsing commands, building the objects, dispatching the commands,
+storing them, and reading them from a socket.
+
+`run` measures them and writes the results to a JSON file,
+`compare` compares two such files and fails if any benchmark regressed.
+
+    python -m tools.bench run --output baseline.json
+    python -m tools.bench run --output current.json
+    python -m tools.bench compare baseline.json current.json --threshold 10
+"""
+
+from __future__ import annotations
+
+import sys
+import socket
+import platform
+import threading as th
+
+import click
+
+from json import JSONDecoder, JSONEncoder
+from timeit import Timer
+from itertools import cycle
+from pathlib import Path
+from typing import Callable, Iterator
+from tinydb.queries import where
+
+from irc import _client, _server
+from irc._client import Client, ClientHandler
+from irc._handler import CommandHandler
+from irc._server import OwnServer, ServerHandler
+from irc.database import Database
+from irc.objects import Command, ServerChannel
+
+
+# Name of a benchmark, and the function it measures
+Benchmark = tuple[str, Callable[[], object]]
+
+
+def _get_command() -> Command:
+    return Command(
+        author="alice",
+        recipient="#channel",
+        identifier="msg",
+        parameters={"content": "Hello world: how are you doing today?"},
+    )
+
+
+def _get_channel(i: int) -> ServerChannel:
+    return ServerChannel(name=f"#channel{i}", host="6667", key="")
+
+
+def codec_benchmarks() -> Iterator[Benchmark]:
+    command = _get_command()
+    raw = repr(command)
+    yield "Command.__repr__", lambda: repr(command)
+
+    server_handler = ServerHandler(OwnServer("localhost", 0, in_memory=True))
+    yield "ServerHandler._parse_command", lambda: server_handler._parse_command(raw)
+
+    Client("bench")
+    client_handler = ClientHandler()
+    yield "ClientHandler._parse_command (frame)", lambda: client_handler._parse_command(raw)
+    user_input = "/msg #channel Hello world: how are you doing today?"
+    yield "ClientHandler._parse_command (input)", lambda: client_handler._parse_command(user_input)
+
+
+def model_benchmarks() -> Iterator[Benchmark]:
+    yield "Command()", _get_command
+    yield "ServerChannel()", lambda: _get_channel(0)
+
+
+def dispatch_benchmarks() -> Iterator[Benchmark]:
+    # A handler doing nothing, to measure the dispatch alone
+    command = _get_command()
+    methods = {name: lambda self, cmd: None for name in CommandHandler.__abstractmethods__}
+    methods["_parse_command"] = lambda self, raw: command
+    handler = type("NullHandler", (CommandHandler, ), methods)()
+    yield "CommandHandler.__call__", lambda: handler("")
+    command_unknown = command.copy(update={"identifier": "unknown"})
+    methods["_parse_command"] = lambda self, raw: command_unknown
+    handler_unknown = type("NullHandler", (CommandHandler, ), methods)()
+    yield "CommandHandler.__call__ (unknown)", lambda: handler_unknown("")
+
+
+def database_benchmarks(sizes: list[int]) -> Iterator[Benchmark]:
+    for size in sizes:
+        database = Database()
+        database.insert_all(ServerChannel, {
+            channel.id: channel.dict()
+            for channel in map(_get_channel, range(size))
+        })
+        channel = _get_channel(size // 2)
+        # TinyDB caches the results of the last queries,
+        # so we search for more names than it remembers.
+        names = cycle([f"#channel{i * size // 32}" for i in range(32)])
+        yield f"Database.upsert ({size})", lambda: database.upsert(channel)
+        yield f"Database.search ({size})", lambda: database.search(ServerChannel, where("name") == next(names))
+        yield f"Database.get_all ({size})", lambda: database.get_all(ServerChannel)
+
+
+def receive_benchmarks(payload_sizes: list[int]) -> Iterator[Benchmark]:
+    client = Client("bench")
+
+    for size in payload_sizes:
+        payload = b"x" * size
+
+        def receive(payload: bytes = payload) -> None:
+            reader, writer = socket.socketpair()
+            with reader, writer:
+                def write() -> None:
+                    writer.sendall(payload)
+                    writer.shutdown(socket.SHUT_WR)
+                thread = th.Thread(target=write)
+                thread.start()
+                client._receive_all(reader)
+                thread.join()
+
+        yield f"Client._receive_all ({size} B)", receive
+
+
+def measure(function: Callable[[], object], repeat: int = 5) -> dict[str, float]:
+    """
+    Returns the time per call of `function`, in seconds:
+    the best and the mean of `repeat` runs, each of them long enough
+    to be measured precisely.
+    """
+    timer = Timer(function)
+    number, _ = timer.autorange()
+    times = [time / number for time in timer.repeat(repeat=repeat, number=number)]
+    return {"best": min(times), "mean": sum(times) / len(times), "calls": number}
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command()
+@click.option("--output", type=click.Path(path_type=Path), default="bench.json",
+              help="File to write the results to.")
+@click.option("--sizes", type=str, default="1000,100000,1000000",
+              help="Comma-separated numbers of records of the database benchmarks.")
+@click.option("--payloads", type=str, default="64,4096,65536,1048576",
+              help="Comma-separated payload sizes (in bytes) of the receive benchmarks.")
+@click.option("--filter", "pattern", type=str, default="",
+              help="Only run the benchmarks whose name contains this.")
+def run(output: Path, sizes: str, payloads: str, pattern: str):
+    """Runs the benchmarks, and writes their results to a file."""
+    # Handling commands logs them, which we don't want to measure
+    _server.printer.verbose = 0
+    _client.printer.verbose = 0
+    benchmarks = [
+        codec_benchmarks(),
+        model_benchmarks(),
+        dispatch_benchmarks(),
+        database_benchmarks(list(map(int, sizes.split(",")))),
+        receive_benchmarks(list(map(int, payloads.split(",")))),
+    ]
+    results = {}
+    for group in benchmarks:
+        for name, function in group:
+            if pattern not in name:
+                continue
+            results[name] = measure(function)
+            click.echo(f"{name:<45}{results[name]['best'] * 1e6:>14.3f} µs")
+    output.write_text(JSONEncoder(indent=2).encode({
+        "python": sys.version,
+        "platform": platform.platform(),
+        "results": results,
+    }))
+    click.echo(f"Results written to {output}")
+
+
+@cli.command()
+@click.argument("baseline", type=click.Path(exists=True, path_type=Path))
+@click.argument("current", type=click.Path(exists=True, path_type=Path))
+@click.option("--threshold", type=float, default=10.0,
+              help="Slowdown (in percent) above which a benchmark regressed.")
+def compare(baseline: Path, current: Path, threshold: float):
+    """Compares two results, and fails if a benchmark regressed."""
+    decoder = JSONDecoder()
+    before = decoder.decode(baseline.read_text())["results"]
+    after = decoder.decode(current.read_text())["results"]
+    regressions = 0
+    click.echo(f"{'benchmark':<45}{'baseline':>14}{'current':>14}{'change':>12}")
+    for name in [name for name in before if name in after]:
+        old, new = before[name]["best"], after[name]["best"]
+        change = (new - old) / old * 100
+        flag = ""
+        if change > threshold:
+            regressions += 1
+            flag = "  REGRESSION"
+        click.echo(f"{name:<45}{old * 1e6:>12.3f}µs{new * 1e6:>12.3f}µs{change:>+11.1f}%{flag}")
+    if regressions:
+        click.echo(f"{regressions} benchmark(s) regressed by more than {threshold}%.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,104 @@
+"""
+Measures how long the entry points and the package take to start,
+and fails if any exceeds its budget. Run it from the root of the
+repository, e.g. in continuous integration:
+
+    python -m tools.importtime
+    python -m tools.importtime --details "import irc._client"
+
+Times are the best of several runs, in fresh interpreters, from which
+the start time of an empty interpreter is subtracted.
+"""
+
+from __future__ import annotations
+
+import sys
+import time
+import subprocess
+
+import click
+
+from pathlib import Path
+
+
+root = Path(__file__).parent.parent
+
+# Name of the measure -> arguments of the interpreter, and budget in milliseconds
+targets: dict[str, tuple[list[str], float]] = {
+    "import irc": (["-c", "import irc"], 20),
+    "client.py --help": (["client.py", "--help"], 100),
+    "server.py --help": (["server.py", "--help"], 100),
+    "import irc._client": (["-c", "import irc._client"], 100),
+    "import irc._server": (["-c", "import irc._server"], 100),
+}
+
+
+def get_start_time(arguments: list[str], runs: int) -> float:
+    """
+    Returns the best time (in milliseconds) the interpreter took to run
+    with `arguments`, out of `runs`.
+    """
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, *arguments],
+            cwd=root,
+            stdout=subprocess.DEVNULL,
+            check=True,
+        )
+        times.append((time.perf_counter() - start) * 1000)
+    return min(times)
+
+
+def get_import_times(arguments: list[str]) -> list[tuple[int, str]]:
+    """
+    Returns the cumulative import time (in microseconds) of each module
+    imported when running the interpreter with `arguments`,
+    as reported by `-X importtime`.
+    """
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", *arguments],
+        cwd=root,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+        check=True,
+    )
+    times = []
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line[len("import time:"):].split("|")
+        times.append((int(cumulative), module.rstrip()))
+    return times
+
+
+@click.command()
+@click.option("--runs", type=int, default=5, help="Runs per measure, the best of which is kept.")
+@click.option("--details", "detailed", type=click.Choice(list(targets)), default=None,
+              help="Only print the slowest modules imported by this measure.")
+@click.option("--top", type=int, default=15, help="Number of modules printed with --details.")
+def measure(runs: int, detailed: str | None, top: int):
+    if detailed is not None:
+        for cumulative, module in sorted(get_import_times(targets[detailed][0]), reverse=True)[:top]:
+            click.echo(f"{cumulative / 1000:>10.1f} ms  {module}")
+        return
+
+    baseline = get_start_time(["-c", "pass"], runs)
+    click.echo(f"Empty interpreter: {baseline:.1f} ms")
+    over_budget = 0
+    for name, (arguments, budget) in targets.items():
+        elapsed = get_start_time(arguments, runs) - baseline
+        flag = ""
+        if elapsed > budget:
+            over_budget += 1
+            flag = "  OVER BUDGET"
+        click.echo(f"{name:<24}{elapsed:>10.1f} ms{budget:>10.0f} ms{flag}")
+    if over_budget:
+        click.echo(f"{over_budget} measure(s) over budget.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    measure()
@@ -0,0 +1,162 @@
+"""
+Runs a network of servers whose links go through proxies emulating a
+real network (see `irc.netem`), and measures how long commands take to
+cross it.
+
+The servers are linked following a topology (see `irc.cluster`), and
+each hosts a channel. Users connected to random servers then join the
+channels hosted by other servers: their joins are routed, hop by hop,
+to the host, and we measure the time until it counts them as members.
+
+    python -m tools.netem --topology line --size 4 --latency 20 --jitter 5
+    python -m tools.netem --topology star --size 6 --bandwidth 65536 --stalls 0.01
+"""
+
+from __future__ import annotations
+
+import time
+import random
+import threading as th
+
+import click
+
+from irc import _server
+from irc.cluster import Cluster, submit, topologies
+from irc.netem import LinkProfile
+from irc.objects import Command
+
+from tools.traces import get_percentile
+
+
+def wait_for_routes(cluster: Cluster, timeout: float) -> bool:
+    """
+    Waits until each server knows a path to all the others.
+    Returns whether they did within `timeout` seconds.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if all(len(server.routing.table) == len(cluster) - 1 for server in cluster.servers):
+            return True
+        time.sleep(0.1)
+    return False
+
+
+def get_join(author: str, host: _server.OwnServer) -> Command:
+    return Command(
+        author=author,
+        recipient=host.name,
+        identifier="join",
+        parameters={"channel": f"#{host.name}", "key": "", "host": host.name},
+    )
+
+
+class Watcher(th.Thread):
+
+    """
+    Polls the hosts, to tell when each join was handled.
+    """
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        # Joins not handled yet: host, channel, user, and when they were sent
+        self.pending: list[tuple[_server.OwnServer, str, str, float]] = []
+        self.latencies: list[float] = []  # In milliseconds
+        self._lock = th.Lock()
+        self._stop_event = th.Event()
+
+    def add(self, host: _server.OwnServer, user: str, sent: float) -> None:
+        with self._lock:
+            self.pending.append((host, f"#{host.name}", user, sent))
+
+    def run(self):
+        while not self._stop_event.wait(0.001):
+            now = time.monotonic()
+            with self._lock:
+                pending = []
+                for join in self.pending:
+                    host, channel, user, sent = join
+                    if host.membership.is_member(channel, user):
+                        self.latencies.append((now - sent) * 1000)
+                    else:
+                        pending.append(join)
+                self.pending = pending
+
+    def stop(self):
+        self._stop_event.set()
+
+
+@click.command()
+@click.option("--topology", type=click.Choice(topologies), default="line")
+@click.option("--size", type=int, default=4, help="Number of servers.")
+@click.option("--port", type=int, default=6700, help="Port of the first server, the next ones follow.")
+@click.option("--latency", type=float, default=20.0, help="One-way latency of each link, in milliseconds.")
+@click.option("--jitter", type=float, default=0.0, help="Maximum deviation from the latency, in milliseconds.")
+@click.option("--bandwidth", type=float, default=None, help="Bandwidth of each link, in bytes per second.")
+@click.option("--stalls", type=float, default=0.0, help="Probability that a chunk stalls, as if a packet was lost.")
+@click.option("--stall-duration", type=float, default=200.0, help="Duration of a stall, in milliseconds.")
+@click.option("--joins", type=int, default=200, help="Number of joins sent.")
+@click.option("--rate", type=float, default=50.0, help="Joins sent per second.")
+@click.option("--seed", type=int, default=None, help="Seed of the random choices, to reproduce a run.")
+def run(topology: str, size: int, port: int, latency: float, jitter: float, bandwidth: float | None,
+        stalls: float, stall_duration: float, joins: int, rate: float, seed: int | None):
+    _server.printer.verbose = 0
+    rng = random.Random(seed)
+    profile = LinkProfile(
+        latency=latency / 1000,
+        jitter=jitter / 1000,
+        bandwidth=bandwidth,
+        stall_probability=stalls,
+        stall_duration=stall_duration / 1000,
+        seed=seed,
+    )
+    click.echo(f"{size} servers ({topology}), links: {profile!r}")
+    with Cluster(range(port, port + size), topology=topology, profile=profile) as cluster:
+        if not wait_for_routes(cluster, timeout=30):
+            click.echo("The servers did not find paths to each other.")
+            return
+        # Each server hosts a channel, created by one of its users
+        for i, server in enumerate(cluster.servers):
+            submit(server, get_join(f"owner{i}", server))
+        while not all(server.membership.has_channel(f"#{server.name}") for server in cluster.servers):
+            time.sleep(0.01)
+
+        watcher = Watcher()
+        watcher.start()
+        start = time.monotonic()
+        for k in range(joins):
+            source, destination = rng.sample(cluster.servers, 2)
+            user = f"user{k}"
+            watcher.add(destination, user, time.monotonic())
+            submit(source, get_join(user, destination))
+            # Keep the rate, whatever the time sending took
+            remaining = start + (k + 1) / rate - time.monotonic()
+            if remaining > 0:
+                time.sleep(remaining)
+        deadline = time.monotonic() + 30
+        while watcher.pending and time.monotonic() < deadline:
+            time.sleep(0.05)
+        watcher.stop()
+        watcher.join()
+
+        latencies = sorted(watcher.latencies)
+        click.echo(f"{len(latencies)}/{joins} joins handled by their host, latencies in milliseconds.")
+        if latencies:
+            click.echo(f"{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}")
+            click.echo("".join(
+                f"{get_percentile(latencies, percentile):>10.1f}"
+                for percentile in (50, 90, 99)
+            ) + f"{latencies[-1]:>10.1f}")
+        click.echo(f"{'link':<16}{'rtt (ms)':>10}{'loss':>8}{'bytes':>10}{'stalls':>8}")
+        for (i, j), proxy in cluster.proxies.items():
+            stats = proxy.get_stats()
+            link = cluster[i].routing.get_stats().get(cluster[j].name, {})
+            rtt = link.get("rtt")
+            click.echo(
+                f"{cluster[i].name + ' -> ' + cluster[j].name:<16}"
+                f"{'-' if rtt is None else f'{rtt:.1f}':>10}"
+                f"{link.get('loss', 0):>8.2f}{stats['bytes']:>10}{stats['stalls']:>8}"
+            )
+
+
+if __name__ == "__main__":
+    run()
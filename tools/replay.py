@@ -0,0 +1,137 @@
+"""
+Replays the traffic captured by a server (see `irc.capture`):
+the frames it received are sent again to a server, over as many
+connections as they were received on, with the same timing
+(`--speed 1`), N times faster (`--speed N`), or as fast as possible
+(`--speed 0`).
+
+    python server.py 6667 --capture capture.bin
+    python -m tools.replay info capture.bin
+    python -m tools.replay run capture.bin 6668 --speed 0
+"""
+
+from __future__ import annotations
+
+import time
+import socket
+import selectors
+import threading as th
+
+import click
+
+from pathlib import Path
+from collections import Counter
+
+from irc.capture import CONNECTION, INBOUND, OUTBOUND, CLOSED, read
+from irc.config import frame_separator, network_buffer_size
+
+
+class _Drain(th.Thread):
+
+    """
+    Reads and discards what the server sends on the replayed connections,
+    so that it is never blocked writing to them.
+    """
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.selector = selectors.DefaultSelector()
+        self.received = 0
+        self._stop_event = th.Event()
+
+    def add(self, connection: socket.socket) -> None:
+        self.selector.register(connection, selectors.EVENT_READ)
+
+    def remove(self, connection: socket.socket) -> None:
+        self.selector.unregister(connection)
+
+    def run(self):
+        while not self._stop_event.is_set():
+            if not self.selector.get_map():
+                time.sleep(0.01)
+                continue
+            for key, _ in self.selector.select(timeout=0.1):
+                try:
+                    part = key.fileobj.recv(network_buffer_size)
+                except (OSError, ValueError):
+                    continue
+                self.received += len(part)
+
+    def stop(self):
+        self._stop_event.set()
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command()
+@click.argument("path", type=click.Path(exists=True, path_type=Path))
+def info(path: Path):
+    """Describes the content of a capture."""
+    kinds = Counter()
+    sizes = Counter()
+    first = last = None
+    for kind, timestamp, _, payload in read(path):
+        kinds[kind] += 1
+        sizes[kind] += len(payload)
+        first = timestamp if first is None else first
+        last = timestamp
+    duration = (last - first) / 1e9 if first is not None else 0
+    click.echo(f"{path}: {duration:.3f} seconds of traffic, {kinds[CONNECTION]} connections.")
+    click.echo(f"{kinds[INBOUND]} frames received ({sizes[INBOUND]} bytes), "
+               f"{kinds[OUTBOUND]} frames sent ({sizes[OUTBOUND]} bytes).")
+
+
+@cli.command()
+@click.argument("path", type=click.Path(exists=True, path_type=Path))
+@click.argument("port", type=int)
+@click.option("--address", type=str, default="localhost",
+              help="Address of the server to send the frames to.")
+@click.option("--speed", type=float, default=1.0,
+              help="Speed of the replay relative to the capture, 0 for as fast as possible.")
+def run(path: Path, port: int, address: str, speed: float):
+    """Sends the frames received in a capture to a server."""
+    connections: dict[int, socket.socket] = {}
+    descriptions: dict[int, str] = {}
+    drain = _Drain()
+    drain.start()
+    frames = sent = 0
+    start = first = None
+    for kind, timestamp, number, payload in read(path):
+        if kind == CONNECTION:
+            descriptions[number] = payload.decode()
+            continue
+        if kind == OUTBOUND:
+            continue
+        if kind == CLOSED:
+            if connection := connections.pop(number, None):
+                drain.remove(connection)
+                connection.close()
+            continue
+        if start is None:
+            start, first = time.perf_counter(), timestamp
+        elif speed > 0:
+            # Wait until the frame is due
+            delay = (timestamp - first) / 1e9 / speed - (time.perf_counter() - start)
+            if delay > 0:
+                time.sleep(delay)
+        connection = connections.get(number)
+        if connection is None:
+            connection = connections[number] = socket.create_connection((address, port), timeout=5)
+            drain.add(connection)
+        connection.sendall(payload + frame_separator)
+        frames += 1
+        sent += len(payload) + len(frame_separator)
+    elapsed = time.perf_counter() - start if start is not None else 0
+    for connection in connections.values():
+        drain.remove(connection)
+        connection.close()
+    drain.stop()
+    click.echo(f"Replayed {frames} frames ({sent} bytes) from {len(descriptions)} connections "
+               f"in {elapsed:.3f} seconds ({frames / elapsed if elapsed else 0:.0f} frames/s).")
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,76 @@
+"""
+Summarizes the traces written when `config.trace_sample_rate` is set:
+for each transition between two stages (e.g. from `enqueue` to `dispatch`,
+the time spent in the queue), prints the distribution of its latency.
+"""
+
+from __future__ import annotations
+
+import click
+
+from json import JSONDecoder
+from pathlib import Path
+from collections import defaultdict
+
+from irc.config import trace_file
+
+
+def load_traces(path: Path) -> dict[str, list[tuple[int, str, str]]]:
+    """
+    Reads a trace file, and returns the hops of each trace,
+    as (time, node, stage) sorted by time.
+    The records of the same trace, written by different nodes, are merged.
+    """
+    traces = defaultdict(set)
+    decoder = JSONDecoder()
+    with path.open() as file:
+        for line in file:
+            if not line.strip():
+                continue
+            record = decoder.decode(line)
+            for hop in record["hops"]:
+                location, _, time = hop.rpartition("@")
+                node, _, stage = location.rpartition("/")
+                traces[record["trace"]].add((int(time), node, stage))
+    return {trace: sorted(hops) for trace, hops in traces.items()}
+
+
+def get_percentile(values: list[float], percentile: float) -> float:
+    """
+    Returns the percentile of sorted values, using the nearest rank.
+    """
+    index = min(len(values) - 1, max(0, round(percentile / 100 * len(values)) - 1))
+    return values[index]
+
+
+@click.command()
+@click.argument("path", type=click.Path(exists=True, path_type=Path), default=trace_file)
+def summarize(path: Path):
+    traces = load_traces(path)
+    latencies = defaultdict(list)
+    totals = []
+    for hops in traces.values():
+        for (start, _, from_stage), (end, _, to_stage) in zip(hops, hops[1:]):
+            latencies[f"{from_stage} -> {to_stage}"].append((end - start) / 1e6)
+        if len(hops) > 1:
+            totals.append((hops[-1][0] - hops[0][0]) / 1e6)
+    latencies["total"] = totals
+
+    click.echo(f"{len(traces)} traces read from {path}, latencies in milliseconds.")
+    click.echo(f"{'transition':<28}{'count':>8}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}")
+    for transition, values in latencies.items():
+        if not values:
+            continue
+        values.sort()
+        click.echo(
+            f"{transition:<28}{len(values):>8}"
+            + "".join(
+                f"{get_percentile(values, percentile):>10.3f}"
+                for percentile in (50, 90, 99)
+            )
+            + f"{values[-1]:>10.3f}"
+        )
+
+
+if __name__ == "__main__":
+    summarize()